@@ -30,6 +30,8 @@ import asyncio
 import functools
 
 from .client import ServerConnection
+from .profiling import DispatchProfiler
+from .scheduling import ConnectScheduler, ReconnectScheduler
 from .utils import CaseInsensitiveDict
 
 __version__ = '0.4.0'
@@ -38,12 +40,21 @@ loop = asyncio.get_event_loop()
 
 
 class Reactor:
-    """Manages IRC connections."""
+    """Manages IRC connections.
+
+    Our servers take turns connecting through ``connector``, a
+    :class:`girc.scheduling.ConnectScheduler`. Servers that lose their connection
+    and were connected with ``auto_reconnect`` are reconnected by ``reconnector``, a
+    :class:`girc.scheduling.ReconnectScheduler`. Both are shared by all our servers.
+    """
 
     def __init__(self, auto_close=True):
         self.servers = CaseInsensitiveDict()
         self.auto_close = auto_close
         self._event_handlers = {}
+        self.connector = ConnectScheduler()
+        self.reconnector = ReconnectScheduler()
+        self.profiler = None
 
     # start and stop
     def run_forever(self):
@@ -60,7 +71,7 @@ class Reactor:
             server.quit(message)
 
     # setting connection info
-    def create_server(self, server_name, *args, **kwargs):
+    def create_server(self, server_name, *args, tracking='full', typed_events=False, **kwargs):
         """Create an IRC server connection slot.
 
         The server will actually be connected to when
@@ -69,11 +80,16 @@ class Reactor:
         Args:
             server_name (str): Name of the server, to be used for functions and accessing the
                 server later through the reactor.
+            tracking (str): How much state to track, ``full``, ``minimal`` or ``none``. See
+                :class:`girc.client.ServerConnection` for details.
+            typed_events (bool): Whether to give common events as slotted objects rather
+                than dicts. See :class:`girc.client.ServerConnection` for details.
 
         Returns:
             server (girc.client.ServerConnection): A not-yet-connected server.
         """
-        server = ServerConnection(name=server_name, reactor=self)
+        server = ServerConnection(name=server_name, reactor=self, tracking=tracking,
+                                  typed_events=typed_events)
 
         if args or kwargs:
             server.set_connect_info(*args, **kwargs)
@@ -84,10 +100,41 @@ class Reactor:
                 server.register_event(info['direction'], verb, info['handler'],
                                       priority=info['priority'])
 
+        if self.profiler is not None:
+            server.enable_profiling(self.profiler)
+
         self.servers[server_name] = server
 
         return server
 
+    # profiling
+    def enable_profiling(self, budget=None):
+        """Start recording how long every event handler on every server takes.
+
+        Args:
+            budget (float): Seconds a handler can take before a ``slow handler`` girc
+                event is dispatched, or None to never warn.
+
+        Returns:
+            profiler (girc.profiling.DispatchProfiler): The profiler we're recording to.
+                Call its ``snapshot()`` method to see the results.
+        """
+        if self.profiler is None:
+            self.profiler = DispatchProfiler()
+        self.profiler.budget = budget
+
+        for name, server in self.servers.items():
+            server.enable_profiling(self.profiler)
+
+        return self.profiler
+
+    def disable_profiling(self):
+        """Stop recording how long event handlers take."""
+        self.profiler = None
+
+        for name, server in self.servers.items():
+            server.disable_profiling()
+
     def _destroy_server(self, server_name):
         """Destroys the given server, called internally."""
         try:
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
-from .utils import CaseInsensitiveDict, CaseInsensitiveList
+from .utils import CaseInsensitiveDict, CaseInsensitiveList, CaseInsensitiveSet
 
 cap_modifiers = {
     '-': 'disabled',
@@ -38,18 +38,39 @@ def cap_list(caps):
     return out
 
 
+# caps we check while handling every message, mapped to the attribute holding
+#   whether they're enabled
+_flag_caps = {
+    'account-tag': 'account_tag',
+    'batch': 'batch',
+    'echo-message': 'echo_message',
+    'labeled-response': 'labeled_response',
+    'server-time': 'server_time',
+}
+
+
 class Capabilities:
-    """Ingests sets of client capabilities and provides access to them."""
+    """Ingests sets of client capabilities and provides access to them.
+
+    Whether some commonly-checked caps are enabled is also available as boolean
+    attributes, such as ``echo_message`` and ``server_time``. These are updated
+    whenever caps are ACK'd, NAK'd or DEL'd.
+    """
 
     def __init__(self, wanted=[]):
         self.available = CaseInsensitiveDict()
         self.wanted = CaseInsensitiveList(wanted)
-        self.enabled = CaseInsensitiveList()
+        self.enabled = CaseInsensitiveSet()
+        self._update_flags()
+
+    def _update_flags(self):
+        for cap, attr in _flag_caps.items():
+            setattr(self, attr, cap in self.enabled)
 
     def ingest(self, cmd, parameters):
         cmd = cmd.casefold()
 
-        if cmd == 'ls':
+        if cmd in ('ls', 'new'):
             if parameters[0] == '*':
                 caps = parameters[1]
             else:
@@ -63,17 +84,23 @@ class Capabilities:
 
         elif cmd == 'ack':
             for cap, value, mods in cap_list(parameters[0]):
-                if cap.startswith('-'):
-                    cap = cap[1:]  # remove -
-                    if cap in self.enabled:
-                        self.enabled.remove(cap)
+                # cap_list turns the leading - into the 'disabled' modifier
+                if 'disabled' in mods:
+                    self.enabled.discard(cap)
                 else:
-                    if cap not in self.enabled:
-                        self.enabled.append(cap)
+                    self.enabled.add(cap)
+            self._update_flags()
 
         elif cmd == 'nak':
             # clients don't change any caps on a NAK
-            pass
+            self._update_flags()
+
+        elif cmd == 'del':
+            for cap, value, mods in cap_list(parameters[0]):
+                if cap in self.available:
+                    del self.available[cap]
+                self.enabled.discard(cap)
+            self._update_flags()
 
     @property
     def to_enable(self):
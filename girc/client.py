@@ -3,7 +3,8 @@
 # Released under the ISC license
 import asyncio
 import base64
-import re
+import time
+import weakref
 
 from . import asyncio_compat
 from .ircreactor.events import EventManager
@@ -11,19 +12,43 @@ from .ircreactor.envelope import RFC1459Message
 
 from .capabilities import Capabilities
 from .features import Features
-from .formatting import unescape
+from .formatting import cached_unescape
 from .info import Info
-from .imapping import IDict, IList, IString
+from .lag import LagMonitor
+from .profiling import DispatchProfiler
+from .imapping import Casemap, IDict, IList, IString
 from .events import message_to_event
-from .utils import validate_hostname, CaseInsensitiveDict
+from .scheduling import default_connector, default_reconnector
+from .utils import CaseInsensitiveDict, batch_joins
 
 loop = asyncio.get_event_loop()
 
+# how much state each server connection keeps track of
+tracking_levels = ('none', 'minimal', 'full')
 
-class ServerConnection(asyncio.Protocol):
-    """Manages a connection to a single server."""
 
-    def __init__(self, name=None, reactor=None):
+class ServerConnection(asyncio.Protocol):
+    """Manages a connection to a single server.
+
+    Args:
+        name (str): Name used for this server.
+        reactor (girc.Reactor): Reactor managing this server.
+        tracking (str): How much state we keep track of. ``full`` tracks users,
+            channels and servers, and events contain ``girc.types.*`` objects.
+            ``minimal`` only tracks the channels we're joined to, and ``none``
+            tracks nothing at all. With these, users, servers and any untracked
+            channels are given in events as plain strings.
+        typed_events (bool): Give message, CTCP, membership, mode and numeric events as
+            slotted ``girc.events.TypedEvent`` objects rather than dicts. These still
+            support dict-style access like ``event['message']``.
+    """
+
+    def __init__(self, name=None, reactor=None, tracking='full', typed_events=False):
+        if tracking not in tracking_levels:
+            raise Exception('Tracking level must be one of: {}'.format(', '.join(tracking_levels)))
+
+        self.tracking = tracking
+        self.typed_events = typed_events
         self.connected = False
         self.registered = False
         self.ready = False
@@ -33,11 +58,20 @@ class ServerConnection(asyncio.Protocol):
         self._girc_events = EventManager()
         self._new_data = ''
 
-        # we keep a list of imappable entities for us to set the casemap on
-        #   when ISUPPORT rolls 'round. we assume the server will keep the same
-        #   casemap, so once we've received one we stop keeping track
+        # set when we quit on purpose, so we know not to reconnect
+        self._quitting = False
+        # channels to rejoin once we've reconnected
+        self._rejoin = []
+
+        # every imappable entity we create shares this casemap, so we only need
+        #   to update it when ISUPPORT rolls 'round. we assume the server will
+        #   keep the same casemap, so once we've received one we ignore changes.
+        #   until then, lists and dicts we create get re-keyed when it arrives
         self._casemap_set = False
-        self._imaps = []
+        self.casemap = Casemap('ascii', provisional=True)
+
+        # istrings that get repeated across lots of users (idents, hostnames)
+        self._interned = weakref.WeakValueDictionary()
 
         # name used for this server, eg: rizon
         self.name = name
@@ -68,6 +102,7 @@ class ServerConnection(asyncio.Protocol):
 
         self.info = Info(self)
         self.connect_info = CaseInsensitiveDict(channels=[])
+        self.lag = LagMonitor(self)
 
         # events
         self.register_event('in', 'welcome', self.rpl_welcome, priority=-9999)
@@ -75,7 +110,8 @@ class ServerConnection(asyncio.Protocol):
         self.register_event('both', 'features', self.rpl_features)
         self.register_event('both', 'endofmotd', self.rpl_endofmotd)
         self.register_event('both', 'nomotd', self.rpl_endofmotd)
-        self.register_event('both', 'ping', self.rpl_ping)
+        self.register_event('in', 'ping', self.rpl_ping)
+        self.register_event('in', 'pong', self.lag.rpl_pong)
 
         # sasl stuff
         self.allow_sasl_fail = False
@@ -85,6 +121,8 @@ class ServerConnection(asyncio.Protocol):
         self.register_event('in', 'saslfail', self.rpl_saslfail)
 
         self.reactor = reactor
+        self.connector = reactor.connector if reactor is not None else default_connector
+        self.reconnector = reactor.reconnector if reactor is not None else default_reconnector
 
     @property
     def channels(self):
@@ -118,6 +156,29 @@ class ServerConnection(asyncio.Protocol):
         for event_manager in event_managers:
             event_manager.register(verb, child_fn, priority=priority)
 
+    def enable_profiling(self, profiler=None):
+        """Start recording how long each of our event handlers takes.
+
+        Args:
+            profiler (girc.profiling.DispatchProfiler): Profiler to record to, shared
+                between servers. By default, a new one is made.
+
+        Returns:
+            profiler (girc.profiling.DispatchProfiler): The profiler we're recording to.
+        """
+        if profiler is None:
+            profiler = DispatchProfiler()
+
+        self._events_in.set_profiler(profiler, (self, 'in'))
+        self._events_out.set_profiler(profiler, (self, 'out'))
+        self._girc_events.set_profiler(profiler, (self, 'girc'))
+        return profiler
+
+    def disable_profiling(self):
+        """Stop recording how long our event handlers take."""
+        for event_manager in (self._events_in, self._events_out, self._girc_events):
+            event_manager.set_profiler(None)
+
     # connect info
     def set_connect_password(self, password):
         """Sets connect password for this server, to be used before connection.
@@ -157,23 +218,33 @@ class ServerConnection(asyncio.Protocol):
         if not self._casemap_set:
             self._casemap_set = True
 
-            casemap = casemap.casefold()
+            self.casemap.set_std(casemap.casefold())
+            self.casemap.settle()
 
-            for obj in self._imaps:
-                obj.set_std(casemap)
-
-    def istring(self, in_string=''):
+    def istring(self, in_string='', intern=False):
         """Return a string that uses this server's IRC casemapping.
 
         This string's equality with other strings, ``lower()``, and ``upper()`` takes this
         server's casemapping into account. This should be used for things such as nicks and
         channel names, where comparing strings using the correct casemapping can be very
         important.
+
+        If ``intern`` is true, the same string object is returned for every
+        identical value while it's in use. This saves memory for values that get
+        repeated across lots of users, such as idents and hostnames.
         """
+        if intern:
+            # key on the plain value so different cases are kept separately
+            key = str(in_string)
+            new_string = self._interned.get(key)
+            if new_string is not None:
+                return new_string
+
         new_string = IString(in_string)
-        new_string.set_std(self.features.get('casemapping'))
-        if not self._casemap_set:
-            self._imaps.append(new_string)
+        new_string.set_casemap(self.casemap)
+
+        if intern:
+            self._interned[key] = new_string
         return new_string
 
     def ilist(self, in_list=[]):
@@ -182,10 +253,9 @@ class ServerConnection(asyncio.Protocol):
         All strings in this list are lowercased using the server's casemapping before inserting
         them into the list, and the ``in`` operator takes casemapping into account.
         """
-        new_list = IList(in_list)
-        new_list.set_std(self.features.get('casemapping'))
-        if not self._casemap_set:
-            self._imaps.append(new_list)
+        new_list = IList()
+        new_list.set_casemap(self.casemap)
+        new_list.extend(in_list)
         return new_list
 
     def idict(self, in_dict={}):
@@ -193,24 +263,31 @@ class ServerConnection(asyncio.Protocol):
 
         All keys in this dictionary are stored and compared using this server's casemapping.
         """
-        new_dict = IDict(in_dict)
-        new_dict.set_std(self.features.get('casemapping'))
-        if not self._casemap_set:
-            self._imaps.append(new_dict)
+        new_dict = IDict()
+        new_dict.set_casemap(self.casemap)
+        new_dict.update(in_dict)
         return new_dict
 
     # protocol connect / disconnect
-    def connect(self, *args, auto_reconnect=False, **kwargs):
+    def connect(self, *args, auto_reconnect=False, priority=10, **kwargs):
         """Connects to the given server.
 
+        We don't connect straight away, but once our reactor's
+        :class:`girc.scheduling.ConnectScheduler` says it's our turn.
+
         Args:
-            auto_reconnect (bool): Automatically reconnect on disconnection.
+            auto_reconnect (bool): Automatically reconnect on disconnection. Reconnects
+                are scheduled by our reactor's :class:`girc.scheduling.ReconnectScheduler`,
+                and once we're back we rejoin our channels and resync their users.
+            priority (int): Servers with lower priorities are connected first.
 
         Other arguments to this function are as usually supplied to
         :meth:`asyncio.BaseEventLoop.create_connection`.
         """
         connection_info = {
             'auto_reconnect': auto_reconnect,
+            'priority': priority,
+            'host': args[0] if args else kwargs.get('host'),
             'args': args,
             'kwargs': kwargs,
         }
@@ -220,10 +297,40 @@ class ServerConnection(asyncio.Protocol):
         if 'user' not in self.connect_info:
             raise Exception('`set_user_info` must be called before connecting to server.')
 
-        # create connection and run
-        connection = loop.create_connection(lambda: self,
-                                            *args, **kwargs)
-        asyncio.Task(connection)
+        self._quitting = False
+        self._request_connection()
+
+    def _request_connection(self):
+        info = self.connect_info['connection']
+        self.connector.request(self, host=info.get('host'), priority=info.get('priority', 10))
+
+    def _open_connection(self):
+        info = self.connect_info['connection']
+        connection = loop.create_connection(lambda: self, *info['args'], **info['kwargs'])
+        task = asyncio_compat.ensure_future(connection)
+        task.add_done_callback(self._connection_attempted)
+
+    def _connection_attempted(self, task):
+        if task.cancelled() or task.exception() is None:
+            return
+
+        print('Connection error: {}'.format(task.exception()))
+        self.connector.forget(self)
+        if self._should_reconnect():
+            self.reconnector.schedule(self)
+
+    def _should_reconnect(self):
+        connection_info = self.connect_info.get('connection', {})
+        return connection_info.get('auto_reconnect') and not self._quitting
+
+    def _reconnect(self):
+        """Called by our reconnector when it's our turn to reconnect."""
+        self.registered = False
+        self.ready = False
+        self._new_data = ''
+        self.nick = self.connect_info['user']['nick']
+        self.capabilities = Capabilities(wanted=self.capabilities.wanted)
+        self._request_connection()
 
     def connection_made(self, transport):
         if 'user' not in self.connect_info:
@@ -246,6 +353,10 @@ class ServerConnection(asyncio.Protocol):
         if message is None:
             message = 'Quit'
 
+        self._quitting = True
+        self.connector.forget(self)
+        self.reconnector.forget(self)
+
         if self.connected:
             self.send('QUIT', params=[message])
 
@@ -253,8 +364,23 @@ class ServerConnection(asyncio.Protocol):
         if not self.connected:
             return
         self.connected = False
+        self.lag.stop()
+        self.info.stop_evicting()
         if exc:
             print('Connection error: {}'.format(exc))
+
+        # in case we dropped before becoming ready
+        self.connector.forget(self)
+
+        if self._should_reconnect():
+            if self.tracking != 'none':
+                self._rejoin = self.info.start_resync()
+            self.registered = False
+            self.ready = False
+            self.reconnector.schedule(self)
+            return
+
+        if exc:
             return
         print('Connection closed')
         self.reactor._destroy_server(self.name)
@@ -288,13 +414,16 @@ class ServerConnection(asyncio.Protocol):
         m = message
         m.server = self
         for name, event in message_to_event('out', m):
-            self.info.handle_event_out(event)
+            if self.tracking != 'none':
+                self.info.handle_event_out(event)
             self._events_out.dispatch(name, event)
             self._events_out.dispatch('all', event)
 
         self.transport.write(bytes(final_message, 'UTF-8'))
 
     def data_received(self, data):
+        started = time.perf_counter()
+
         # feed in new data from server
         self._new_data += data.decode('UTF-8', 'replace')
         messages = []
@@ -322,29 +451,33 @@ class ServerConnection(asyncio.Protocol):
             m = RFC1459Message.from_message(data)
             m.server = self
             for name, event in message_to_event('in', m):
-                self.info.handle_event_in(event)
+                if self.tracking != 'none':
+                    self.info.handle_event_in(event)
                 self._events_in.dispatch(name, event)
                 self._events_in.dispatch('all', event)
 
+        if messages:
+            self.lag.processing.append(time.perf_counter() - started)
+
     # commands
     def action(self, target, message, formatted=True, tags=None):
         """Send an action to the given target."""
         if formatted:
-            message = unescape(message)
+            message = cached_unescape(message)
 
         self.ctcp(target, 'ACTION', message)
 
     def msg(self, target, message, formatted=True, tags=None):
         """Send a privmsg to the given target."""
         if formatted:
-            message = unescape(message)
+            message = cached_unescape(message)
 
         self.send('PRIVMSG', params=[target, message], source=self.nick, tags=tags)
 
     def notice(self, target, message, formatted=True, tags=None):
         """Send a notice to the given target."""
         if formatted:
-            message = unescape(message)
+            message = cached_unescape(message)
 
         self.send('NOTICE', params=[target, message], source=self.nick, tags=tags)
 
@@ -483,6 +616,19 @@ class ServerConnection(asyncio.Protocol):
         if not self.ready:
             self.ready = True
 
+            # ISUPPORT is done, so if we haven't got a casemapping by now we won't get one
+            self.casemap.settle()
+
+            # let the next server start connecting
+            time_to_ready = self.connector.ready(self)
+            self.reconnector.forget(self)
+            self._girc_events.dispatch('ready', {
+                'server': self,
+                'time_to_ready': time_to_ready,
+            })
+            self.lag.start()
+            self.info.start_evicting()
+
             # identify if we have to
             nickserv_info = self.connect_info.get('nickserv', {})
             if nickserv_info:
@@ -491,7 +637,14 @@ class ServerConnection(asyncio.Protocol):
 
             # join channels
             seconds = self.connect_info.get('channel_wait_seconds', 0)
-            channels = self.connect_info.get('channels', [])
+            channels = list(self.connect_info.get('channels', []))
+
+            # and rejoin the channels we were in before reconnecting
+            if self._rejoin:
+                names = self.ilist([channel.split(' ')[0] for channel in channels])
+                channels += [channel for channel in self._rejoin
+                             if channel.split(' ')[0] not in names]
+                self._rejoin = []
 
             if seconds:
                 @asyncio.coroutine
@@ -507,19 +660,18 @@ class ServerConnection(asyncio.Protocol):
         self.send('PONG', params=event['params'])
 
     # convenience
+    def classify(self, name):
+        """Return 'channel', 'server' or 'nick' for the given name, or None if it's none of them."""
+        return self.features.classifier.classify(name)
+
     def is_server(self, name):
-        return validate_hostname(name)
+        return self.features.classifier.classify(name) == 'server'
 
     def is_channel(self, name):
-        if name[0] in self.features.get('chantypes'):
-            return True
-        return False
+        return self.features.classifier.classify(name) == 'channel'
 
     def is_nick(self, name):
-        # we cannot assume how long nicknames can be for other users
-        #   based on NICKLEN, spec forbids it
-        nickmatch = r'^[a-z_\-\[\]\\^{}|`][a-z0-9_\-\[\]\\^{}|`]+$'
-        return name in self.info.users or re.match(nickmatch, name)
+        return name in self.info.users or self.features.classifier.classify(name) == 'nick'
 
     # commands
     def join_channels(self, *channels, wait_seconds=0):
@@ -531,19 +683,17 @@ class ServerConnection(asyncio.Protocol):
                 self.connect_info['channel_wait_seconds'] = wait_seconds
             return True
 
+        joins = []
         for channel in channels:
-            params = []
-
             if ' ' in channel:
                 channel, key = channel.split(' ')
             else:
                 key = None
+            joins.append((channel, key))
 
-            params.append(channel)
-            if key:
-                params.append(key)
-
-            self.join_channel(channel, key=key)
+        # join as many channels as we can in each line
+        for params in batch_joins(joins, max_length=self.features.linelen or 512):
+            self.send('JOIN', params=params)
 
     def nickserv_identify(self, password, use_nick=None):
         """Identify to NickServ (legacy)."""
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
-import time
+import re
 
 from .formatting import escape
-from .utils import NickMask, parse_modes
+from .types import Channel, Server, User
+from .utils import NickMask, parse_modes, parse_server_time
 
 NAME_ATTR = 0
 INFO_ATTR = 1
@@ -13,7 +14,7 @@ INFO_ATTR = 1
 # if the param name starts with 'escaped_', the param is escaped
 #   before being set
 # the params 'source' and 'target' will be converted to Client,
-#   Channel, or Server objects in the event dict
+#   Channel, or Server objects in the event dict when they're first accessed
 _verb_param_map = {
     'target': {
         0: (
@@ -102,22 +103,48 @@ _verb_param_map = {
 }
 
 
+X_QUOTE = '\\'
+X_DELIM = '\x01'
+
+# ctcp-level quoting, \a is a delimiter and \ followed by anything else is that thing
+_ctcp_quoted = re.compile(r'\\(.?)', re.DOTALL)
+
+
+def _ctcp_dequote_char(match):
+    char = match.group(1)
+    if char == 'a':
+        return X_DELIM
+    return char
+
+
+def ctcp_dequote(raw):
+    """Return the given string with ctcp-level quoting removed."""
+    if X_QUOTE not in raw:
+        return raw
+    return _ctcp_quoted.sub(_ctcp_dequote_char, raw)
+
+
 def ctcp_unpack_message(info):
     """Given a an input message (privmsg/pubmsg/notice), return events."""
     verb = info['verb']
-    message = info['params'][1]
+    message = str(info['params'][1])
 
     # NOTE: full CTCP dequoting and unpacking is not done here, only a subset
     #   this is because doing the full thing breaks legitimate messages
 
+    # fast path for normal messages, which don't need unpacking or dequoting
+    if X_DELIM not in message and X_QUOTE not in message and X_QUOTE not in info['params'][0]:
+        if not message:
+            return []
+        if len(info['params']) > 2:
+            info['params'] = info['params'][:2]
+        return [[verb, info]]
+
     # basics
     infos = []
 
-    X_QUOTE = '\\'
-    X_DELIM = '\x01'
-
     # tagged data
-    messages = str(message).split(X_DELIM)
+    messages = message.split(X_DELIM)
 
     for i in range(len(messages)):
         msg = messages[i]
@@ -152,39 +179,443 @@ def ctcp_unpack_message(info):
 
         for attr in attrs:
             if isinstance(infos[i][INFO_ATTR][attr], (list, tuple)):
-                raw_messages = infos[i][INFO_ATTR][attr]
+                infos[i][INFO_ATTR][attr] = [ctcp_dequote(raw)
+                                             for raw in infos[i][INFO_ATTR][attr]]
             else:
-                raw_messages = [infos[i][INFO_ATTR][attr]]
-
-            messages = []
-            for raw in raw_messages:
-                unquoted = ''
-                while len(raw):
-                    char = raw[0]
-                    raw = raw[1:]
-
-                    if char == X_QUOTE:
-                        if not len(raw):
-                            continue
-                        key = raw[0]
-                        raw = raw[1:]
-
-                        if key == 'a':
-                            unquoted += X_DELIM
-                        elif key == X_QUOTE:
-                            unquoted += X_QUOTE
-                        else:
-                            unquoted += key
-                    else:
-                        unquoted += char
-                messages.append(unquoted)
+                infos[i][INFO_ATTR][attr] = ctcp_dequote(infos[i][INFO_ATTR][attr])
 
-            if isinstance(infos[i][INFO_ATTR][attr], (list, tuple)):
-                infos[i][INFO_ATTR][attr] = messages
+    return infos
+
+
+def _map_untracked_entities(server, info):
+    """Map names in the given event info when we aren't fully tracking state.
+
+    Users and servers are left as plain strings. With minimal tracking,
+    channels we're joined to become ``girc.types.Channel`` objects.
+    """
+    if info.get('channels'):
+        info['channels'] = info['channels'].split(',')
+    if info.get('users'):
+        info['users'] = info['users'].split(',')
+
+    if server.tracking != 'minimal':
+        return
+
+    for attr in ('source', 'target', 'channel'):
+        name = info.get(attr)
+        if name and isinstance(name, str) and server.is_channel(name):
+            info[attr] = server.info.channels.get(name, name)
+
+    if info.get('channels'):
+        # we only start tracking channels once we join them
+        source = info.get('source')
+        if info['verb'] == 'join' and source and NickMask(source).nick == server.nick:
+            server.info.create_channels(*info['channels'])
+
+        info['channels'] = [server.info.channels.get(name, name) for name in info['channels']]
+
+
+def _track_entity(server, name):
+    """Create or refresh the given name in our info, and return what kind of name it is."""
+    kind = server.classify(name)
+    if kind == 'channel':
+        server.info.create_channel(name)
+    elif kind == 'server':
+        server.info.create_server(name)
+    else:
+        # if this isn't a valid nick, we assume it's a user with messed up characters
+        kind = 'nick'
+        server.info.create_user(name)
+    return kind
+
+
+def _lookup_entity(server, kind, name):
+    """Return the object for an entity we've already tracked.
+
+    Events can be held onto and read after the entity's been removed from our
+    info (a channel we've parted, a user who's quit). Rather than adding it back,
+    we give an object that isn't tracked.
+    """
+    if kind == 'channel':
+        entity = server.info.channels.get(name)
+        return entity if entity is not None else Channel(server, name)
+    elif kind == 'server':
+        entity = server.info.servers.get(name)
+        return entity if entity is not None else Server(server, name)
+
+    entity = server.info.users.get(NickMask(name).nick)
+    return entity if entity is not None else User(server, name)
+
+
+def _resolve_entity(event, value):
+    kind, name = value
+    return _lookup_entity(event['server'], kind, name)
+
+
+def _resolve_channels(event, names):
+    return [_lookup_entity(event['server'], 'channel', name) for name in names]
+
+
+def _resolve_users(event, names):
+    return [_lookup_entity(event['server'], 'nick', name) for name in names]
+
+
+def _resolve_from_to(event, value):
+    server = event['server']
+    verb = event['verb']
+    from_to = None
+
+    if verb in ('pubmsg', 'pubnotice', 'pubaction'):
+        from_to = event.get('target')
+    elif verb in ('privmsg', 'privnotice', 'privaction'):
+        if event['direction'] == 'out' or server.capabilities.echo_message:
+            from_to = event.get('target')
+        else:
+            from_to = event.get('source')
+
+    if isinstance(from_to, str):
+        kind = server.classify(from_to)
+        if kind == 'server':
+            from_to = None
+        elif kind != 'channel':
+            from_to = NickMask(from_to).nick
+    elif from_to is not None and from_to.is_server:
+        from_to = None
+
+    if from_to is None:
+        raise KeyError('from_to')
+    return from_to
+
+
+def _resolve_will_be_echod(event, value):
+    return (event['verb'] in ('pubmsg', 'pubnotice', 'privmsg', 'privnotice') and
+            event['direction'] == 'out' and
+            event['server'].capabilities.echo_message)
+
+
+_resolvers = {
+    'source': _resolve_entity,
+    'target': _resolve_entity,
+    'channel': _resolve_entity,
+    'channels': _resolve_channels,
+    'users': _resolve_users,
+    'from_to': _resolve_from_to,
+    'will_be_echod': _resolve_will_be_echod,
+}
+
+_from_to_verbs = ('pubmsg', 'pubnotice', 'pubaction', 'privmsg', 'privnotice', 'privaction')
+
+
+class Event(dict):
+    """An event dict that works out some of its values when they're first accessed.
+
+    Users, channels and servers are added to our ``Info`` as soon as the event
+    is created, but lots of handlers only look at things like the ``message``.
+    So we only look up the objects for ``source``, ``target``, ``channel``,
+    ``channels``, ``users``, ``from_to`` and ``will_be_echod`` once a handler
+    (or ``Info``) asks for them.
+
+    Other than that, this acts like a normal dict.
+    """
+
+    __slots__ = ('_lazy',)
+
+    def __init__(self, info, lazy):
+        dict.__init__(self, info)
+
+        # maps keys we haven't worked out yet to their raw values
+        self._lazy = lazy
+
+    def __missing__(self, key):
+        if key not in self._lazy:
+            raise KeyError(key)
+
+        value = _resolvers[key](self, self._lazy.pop(key))
+        self[key] = value
+        return value
+
+    def _resolve_all(self):
+        for key in list(self._lazy):
+            self.get(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if key in self._lazy:
+            self.get(key)
+        return dict.__contains__(self, key)
+
+    def __delitem__(self, key):
+        if key in self._lazy:
+            self.get(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        if key in self._lazy:
+            self.get(key)
+        return dict.pop(self, key, *args)
+
+    def __iter__(self):
+        self._resolve_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._resolve_all()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._resolve_all()
+        if isinstance(other, Event):
+            other._resolve_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def keys(self):
+        self._resolve_all()
+        return dict.keys(self)
+
+    def values(self):
+        self._resolve_all()
+        return dict.values(self)
+
+    def items(self):
+        self._resolve_all()
+        return dict.items(self)
+
+    def copy(self):
+        self._resolve_all()
+        return dict(self)
+
+    def __repr__(self):
+        self._resolve_all()
+        return dict.__repr__(self)
+
+
+class TypedEvent:
+    """Base class for typed events, given instead of dicts with ``typed_events``.
+
+    Each verb family has its own class with a fixed set of fields, stored in
+    slots. Fields can be accessed as attributes (``event.message``) or like a
+    dict (``event['message']``). Fields the message didn't have are treated
+    like missing keys. As with ``Event``, users, channels and servers are only
+    looked up when they're first accessed.
+    """
+
+    _fields = ('server', 'direction', 'verb', 'tags', 'source', 'params', 'server_time',
+               'will_be_echod')
+    __slots__ = _fields + ('_lazy',)
+
+    @classmethod
+    def from_info(cls, info, lazy):
+        """Return a new event from the given info dict, or None if it doesn't fit."""
+        event = cls.__new__(cls)
+
+        # every info dict has these
+        event.server = info['server']
+        event.direction = info['direction']
+        event.verb = info['verb']
+        event.tags = info['tags']
+        event.params = info['params']
+        event._lazy = lazy
+
+        # and usually one or two of these, which we look for in a fixed order
+        extra = len(info) - 5
+        if extra:
+            for key in cls._extra_fields:
+                if key in info:
+                    setattr(event, key, info[key])
+                    extra -= 1
+                    if not extra:
+                        break
             else:
-                infos[i][INFO_ATTR][attr] = messages[0]
+                return None
 
-    return infos
+        return event
+
+    def __getattr__(self, name):
+        # only called for fields we haven't set yet
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        try:
+            raw = self._lazy.pop(name)
+        except KeyError:
+            raise AttributeError(name)
+
+        try:
+            value = _resolvers[name](self, raw)
+        except KeyError:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self._field_set:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, _no_value) is not _no_value
+
+    def keys(self):
+        return [key for key in self._fields if key in self]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def serialize(self):
+        """Return a dict of this event's fields, using plain values.
+
+        Servers, users and channels are given as their names, so this can be
+        easily encoded as JSON and so on.
+        """
+        out = {}
+        for key, value in self.items():
+            if key == 'server':
+                value = value.name
+            elif key == 'source' and getattr(value, 'is_user', False):
+                value = value.nickmask
+            elif isinstance(value, list):
+                value = [getattr(item, 'name', item) for item in value]
+            elif key == 'prefixes':
+                value = {getattr(user, 'name', user): prefixes
+                         for user, prefixes in value.items()}
+            elif hasattr(value, 'is_server'):
+                value = value.name
+            out[key] = value
+        return out
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, dict(self.items()))
+
+
+_no_value = object()
+
+
+def _make_getitem(fields):
+    """Return a ``__getitem__`` that reads the given fields from their slots."""
+    def __getitem__(self, key):
+        if key in fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+    return __getitem__
+
+
+# fields that every event's info has
+_core_fields = ('server', 'direction', 'verb', 'tags', 'params')
+
+
+class MessageEvent(TypedEvent):
+    """privmsg, pubmsg, privnotice and pubnotice events."""
+
+    _fields = TypedEvent._fields + ('target', 'channel', 'message', 'from_to')
+    __slots__ = _fields[len(TypedEvent._fields):]
+
+
+class CtcpEvent(TypedEvent):
+    """ctcp and ctcp_reply events."""
+
+    _fields = TypedEvent._fields + ('target', 'ctcp_verb', 'ctcp_text')
+    __slots__ = _fields[len(TypedEvent._fields):]
+
+
+class ActionEvent(TypedEvent):
+    """privaction and pubaction events."""
+
+    _fields = TypedEvent._fields + ('target', 'channel', 'message', 'from_to', 'ctcp_verb',
+                                    'ctcp_text')
+    __slots__ = _fields[len(TypedEvent._fields):]
+
+
+class MembershipEvent(TypedEvent):
+    """join, part, kick and quit events."""
+
+    _fields = TypedEvent._fields + ('channels', 'channel', 'user', 'message')
+    __slots__ = _fields[len(TypedEvent._fields):]
+
+
+class ModeEvent(TypedEvent):
+    """umode, cmode and cmodeis events."""
+
+    _fields = TypedEvent._fields + ('target', 'channel', 'modestring', 'modes')
+    __slots__ = _fields[len(TypedEvent._fields):]
+
+
+class NumericEvent(TypedEvent):
+    """Events for numerics that aren't handled by the other types."""
+
+    _fields = TypedEvent._fields + ('target', 'nick', 'message', 'channel', 'topic', 'names',
+                                    'users', 'prefixes', 'timestamp', 'reason')
+    __slots__ = _fields[len(TypedEvent._fields):]
+
+
+for event_class in (TypedEvent, MessageEvent, CtcpEvent, ActionEvent, MembershipEvent,
+                    ModeEvent, NumericEvent):
+    event_class._field_set = frozenset(event_class._fields)
+    # fields only this type has are the likeliest to be there, so they go first
+    event_class._extra_fields = (event_class._fields[len(TypedEvent._fields):] +
+                                 tuple(key for key in TypedEvent._fields
+                                       if key not in _core_fields))
+    event_class.__getitem__ = _make_getitem(event_class._field_set)
+
+_typed_events = {
+    'privmsg': MessageEvent,
+    'pubmsg': MessageEvent,
+    'privnotice': MessageEvent,
+    'pubnotice': MessageEvent,
+    'ctcp': CtcpEvent,
+    'ctcp_reply': CtcpEvent,
+    'privaction': ActionEvent,
+    'pubaction': ActionEvent,
+    'join': MembershipEvent,
+    'part': MembershipEvent,
+    'kick': MembershipEvent,
+    'quit': MembershipEvent,
+    'umode': ModeEvent,
+    'cmode': ModeEvent,
+    'cmodeis': ModeEvent,
+}
+
+
+def _make_event(server, name, info, lazy, is_numeric):
+    """Return the right event object for the given info."""
+    if server.typed_events:
+        event_class = _typed_events.get(name)
+        if event_class is None and is_numeric:
+            event_class = NumericEvent
+
+        if event_class is not None:
+            event = event_class.from_info(info, lazy)
+            if event is not None:
+                return event
+
+    return Event(info, lazy)
 
 
 def message_to_event(direction, message):
@@ -194,9 +625,11 @@ def message_to_event(direction, message):
     and deconstructing verbs properly.
     """
     server = message.server
+    tracking = server.tracking
 
     # change numerics into nice names
-    if message.verb in numerics:
+    is_numeric = message.verb in numerics
+    if is_numeric:
         message.verb = numerics[message.verb]
     verb = message.verb.lower()
 
@@ -219,8 +652,9 @@ def message_to_event(direction, message):
     info['verb'] = verb
 
     if 'time' in info['tags']:
-        info['server_time'] = time.strptime(info['tags']['time'],
-                                            '%Y-%m-%dT%H:%M:%S.%fZ')
+        server_time = parse_server_time(info['tags']['time'] or '')
+        if server_time is not None:
+            info['server_time'] = server_time
 
     infos = [[verb, info], ]
 
@@ -275,9 +709,7 @@ def message_to_event(direction, message):
 
         if name == 'cmode' and len(infos[i][INFO_ATTR]['params']) > 1:
             modestring = infos[i][INFO_ATTR]['params'][1:]
-            chanmodes = server.features.get('chanmodes')
-            prefixes = list(server.features.get('prefix').keys())
-            modes = parse_modes(modestring, chanmodes, prefixes)
+            modes = parse_modes(modestring, table=server.features.chanmode_table)
 
             infos[i][INFO_ATTR]['modestring'] = ' '.join(modestring).strip()
             infos[i][INFO_ATTR]['modes'] = modes
@@ -285,8 +717,7 @@ def message_to_event(direction, message):
         if name == 'cmodeis':
             if len(infos[i][INFO_ATTR]['params']) > 2:
                 modestring = infos[i][INFO_ATTR]['params'][2:]
-                chanmodes = server.features.get('chanmodes')
-                modes = parse_modes(modestring, chanmodes)
+                modes = parse_modes(modestring, table=server.features.chanmode_table)
 
                 infos[i][INFO_ATTR]['modestring'] = ' '.join(modestring).strip()
                 infos[i][INFO_ATTR]['modes'] = modes
@@ -296,7 +727,8 @@ def message_to_event(direction, message):
 
         if name == 'namreply':
             channel_name = infos[i][INFO_ATTR]['params'][2]
-            server.info.create_channel(channel_name)
+            if tracking == 'full':
+                server.info.create_channel(channel_name)
             channel = server.info.channels.get(channel_name)
 
             nice_names = []
@@ -306,86 +738,65 @@ def message_to_event(direction, message):
             else:
                 raw_names = []
 
+            prefix_chars = server.features.prefix_chars
             for name in raw_names:
                 # InspIRCd sends us an empty last param because they are cool
                 if not len(name):
                     continue
 
-                prefixes = ''
-                while name[0] in server.features.available['prefix'].values():
-                    prefixes += name[0]
-                    name = name[1:]
+                nick_start = len(name) - len(name.lstrip(prefix_chars))
+                prefixes = name[:nick_start]
+                name = name[nick_start:]
 
                 nick = NickMask(name).nick
-
-                server.info.create_user(nick)
                 nice_names.append(name)
-                server.info.create_user(name)
-                user = server.info.users.get(nick)
-                channel_prefixes[user] = prefixes
-                channel.add_user(nick, prefixes=prefixes)
+
+                if tracking == 'full':
+                    server.info.create_user(nick)
+                    server.info.create_user(name)
+                    channel_prefixes[server.info.users.get(nick)] = prefixes
+                else:
+                    channel_prefixes[nick] = prefixes
+
+                if channel is not None:
+                    channel.add_user(nick, prefixes=prefixes)
 
             infos[i][INFO_ATTR]['users'] = ','.join(nice_names)
             infos[i][INFO_ATTR]['prefixes'] = channel_prefixes
 
         # source / target mapping
-        for attr in ('source', 'target', 'channel'):
-            if attr in infos[i][INFO_ATTR] and infos[i][INFO_ATTR][attr]:
-                source = infos[i][INFO_ATTR][attr]
-                if server.is_channel(source):
-                    server.info.create_channel(source)
-                    infos[i][INFO_ATTR][attr] = server.info.channels.get(source)
-                elif '.' in source and server.is_server(source):
-                    server.info.create_server(source)
-                    infos[i][INFO_ATTR][attr] = server.info.servers.get(source)
-                elif server.is_nick(source):
-                    server.info.create_user(source)
-                    infos[i][INFO_ATTR][attr] = server.info.users.get(NickMask(source).nick)
-                else:  # we assume this is a user with messed up characters
-                    server.info.create_user(source)
-                    infos[i][INFO_ATTR][attr] = server.info.users.get(NickMask(source).nick)
-
-        if 'channels' in infos[i][INFO_ATTR] and infos[i][INFO_ATTR]['channels']:
-            channels = []
-            for chan in infos[i][INFO_ATTR]['channels'].split(','):
-                server.info.create_channel(chan)
-                channels.append(server.info.channels.get(chan))
-            infos[i][INFO_ATTR]['channels'] = channels
-
-        if 'users' in infos[i][INFO_ATTR] and infos[i][INFO_ATTR]['users']:
-            users = []
-            for user in infos[i][INFO_ATTR]['users'].split(','):
-                server.info.create_user(user)
-                users.append(server.info.users.get(NickMask(user).nick))
-            infos[i][INFO_ATTR]['users'] = users
+        #   with full tracking, these are tracked in our info straight away, but
+        #   only converted into objects when first accessed
+        lazy = {}
+        if tracking == 'full':
+            for attr in ('source', 'target', 'channel'):
+                name = infos[i][INFO_ATTR].get(attr)
+                if name:
+                    infos[i][INFO_ATTR].pop(attr)
+                    lazy[attr] = (_track_entity(server, name), name)
+            for attr in ('channels', 'users'):
+                names = infos[i][INFO_ATTR].get(attr)
+                if names:
+                    infos[i][INFO_ATTR].pop(attr)
+                    names = names.split(',')
+                    for name in names:
+                        if attr == 'channels':
+                            server.info.create_channel(name)
+                        else:
+                            server.info.create_user(name)
+                    lazy[attr] = names
+        else:
+            _map_untracked_entities(server, infos[i][INFO_ATTR])
 
         # custom from_to attribute for ease in bots
-        verb = infos[i][INFO_ATTR]['verb']
-        dir = infos[i][INFO_ATTR]['direction']
-        source = infos[i][INFO_ATTR].get('source')
-        target = infos[i][INFO_ATTR].get('target')
-
-        if verb in ['pubmsg', 'pubnotice', 'pubaction']:
-            infos[i][INFO_ATTR]['from_to'] = target
-        elif verb in ['privmsg', 'privnotice', 'privaction']:
-            if dir == 'out':
-                infos[i][INFO_ATTR]['from_to'] = target
-            elif dir == 'in':
-                if 'echo-message' in server.capabilities.enabled:
-                    infos[i][INFO_ATTR]['from_to'] = target
-                else:
-                    infos[i][INFO_ATTR]['from_to'] = source
-        if 'from_to' in infos[i][INFO_ATTR] and infos[i][INFO_ATTR]['from_to'] is None:
-            del infos[i][INFO_ATTR]['from_to']
-
-        # convenience function so unnecessary messages can get ignored easily
-        infos[i][INFO_ATTR]['will_be_echod'] = False
-        if verb in ['pubmsg', 'pubnotice', 'privmsg', 'privnotice']:
-            if dir == 'out' and 'echo-message' in server.capabilities.enabled:
-                infos[i][INFO_ATTR]['will_be_echod'] = True
-
-        if 'from_to' in infos[i][INFO_ATTR] and infos[i][INFO_ATTR]['from_to'].is_server:
-            del infos[i][INFO_ATTR]['from_to']
+        if infos[i][INFO_ATTR]['verb'] in _from_to_verbs:
+            lazy['from_to'] = None
+
+        # convenience attribute so unnecessary messages can get ignored easily
+        lazy['will_be_echod'] = None
+
+        infos[i][INFO_ATTR] = _make_event(server, infos[i][NAME_ATTR], infos[i][INFO_ATTR], lazy,
+                                          is_numeric)
 
     return infos
 
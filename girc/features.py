@@ -3,7 +3,7 @@
 # Released under the ISC license
 from collections import OrderedDict
 
-from .utils import CaseInsensitiveDict
+from .utils import CaseInsensitiveDict, NameClassifier, compile_mode_table
 
 _limits = [
     'nicklen',
@@ -31,6 +31,29 @@ class Features:
         self.available = CaseInsensitiveDict()
         self.s = server_connection
 
+        # channel mode classifications, recompiled whenever CHANMODES or PREFIX change
+        self.chanmode_table = {}
+
+        # each prefix mode gets a bit, with higher privileges in higher bits. a
+        #   member's prefix string maps one-to-one with a mask of these bits
+        self.prefix_mode_bits = {}
+        self.prefix_char_bits = {}
+        self.privs_masks = {}
+        self.prefix_masks = {}
+        self._prefix_strings = {}
+
+        # typed views of the features we use most, kept up to date by ingest so hot
+        #   code doesn't need to look them up in available
+        self.chantypes = frozenset('#')
+        self.list_modes = ''
+        self.prefix_chars = ''
+        self.prefix_modes = {}
+        for limit in _limits:
+            setattr(self, limit, None)
+
+        # tells channels, servers and nicks apart, replaced whenever CHANTYPES changes
+        self.classifier = NameClassifier(self.chantypes)
+
         # RFC1459 basics, plus LINELEN
         self.ingest('PREFIX=(ov)@+', 'CHANTYPES=#', 'LINELEN=512', 'NICKLEN=9')
 
@@ -85,7 +108,56 @@ class Features:
         else:
             return value
 
+    def _compile_modes(self):
+        chanmodes = self.available.get('chanmodes', ['', '', '', ''])
+        prefix = self.available.get('prefix', {})
+        self.chanmode_table = compile_mode_table(chanmodes, ''.join(prefix.keys()))
+        self.list_modes = chanmodes[0]
+
+        # prefix chars from highest to lowest privilege, and the modes they stand for
+        self.prefix_chars = ''.join(reversed(list(prefix.values())))
+        self.prefix_modes = {char: mode for mode, char in prefix.items()}
+
+        self.prefix_mode_bits = {}
+        self.prefix_char_bits = {}
+        for mode, char in prefix.items():
+            bit = 1 << self.chanmode_table[mode][3]
+            self.prefix_mode_bits[mode] = bit
+            self.prefix_char_bits[char] = bit
+
+        # each prefix mode along with every mode above it
+        all_bits = (1 << len(prefix)) - 1
+        self.privs_masks = {mode: all_bits & ~(bit - 1)
+                            for mode, bit in self.prefix_mode_bits.items()}
+
+        self.prefix_masks = {}
+        self._prefix_strings = {}
+
+    def prefix_mask(self, prefixes):
+        """Return the rank bitmask for the given prefix string, like '@+'."""
+        mask = self.prefix_masks.get(prefixes)
+        if mask is None:
+            mask = 0
+            for char in prefixes or '':
+                mask |= self.prefix_char_bits.get(char, 0)
+        return mask
+
+    def prefix_string(self, mask):
+        """Return the prefix string for the given rank bitmask, highest privilege first.
+
+        The same string object is returned for every member with the same privileges.
+        """
+        string = self._prefix_strings.get(mask)
+        if string is None:
+            string = ''.join(char for char, bit in reversed(list(self.prefix_char_bits.items()))
+                             if mask & bit)
+            self._prefix_strings[mask] = string
+            self.prefix_masks[string] = mask
+        return string
+
     def ingest(self, *parameters):
+        changed = set()
+
         for feature in parameters:
             if feature.startswith('-'):
                 feature = feature[1:].casefold()
@@ -94,6 +166,7 @@ class Features:
                         del self.available[feature]
                     except KeyError:
                         pass
+                    changed.add(feature)
             else:
                 if '=' in feature:
                     feature, value = feature.split('=', 1)
@@ -108,11 +181,22 @@ class Features:
                     value = int(value)
 
                 self.available[feature] = value
+                changed.add(feature)
 
                 # because server sets casemapping
                 if feature == 'casemapping':
                     self.s.set_casemapping(value)
 
+        if 'chanmodes' in changed or 'prefix' in changed:
+            self._compile_modes()
+        if 'chantypes' in changed:
+            chantypes = self.available.get('chantypes', '#')
+            self.chantypes = frozenset(chantypes if isinstance(chantypes, str) else '')
+            self.classifier = NameClassifier(self.chantypes)
+        for limit in _limits:
+            if limit in changed:
+                setattr(self, limit, self.available.get(limit))
+
     def get(self, key, default=None):
         return self.available.get(key, default)
 
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
+import collections
+import functools
+import html
+import re
+
 escape_character = '$'
 format_dict = {
     'b': '\x02',  # bold
@@ -114,31 +119,35 @@ def extract_girc_colours(msg, fill_last):
         return '{}'.format(fore.zfill(2) if fill_last else fore), msg
 
 
+# escaping replaces most formatting characters directly, colours are handled separately
+_escape_table = str.maketrans({irc_char: escape_character + escape_key
+                               for escape_key, irc_char in format_dict.items()
+                               if escape_key != 'c'})
+_escape_table[ord(escape_character)] = escape_character + escape_character
+
+# a colour code is 0-15 with an optional leading zero, or a single digit
+_irc_colour_code = '([01][0-5]|[0-9])'
+_irc_colours = re.compile('\x03(?:{0}(?:,{0})?)?'.format(_irc_colour_code))
+
+
+def _escape_colours(match):
+    fore, back = match.groups()
+    if fore is None:
+        return escape_character + 'c[]'
+    if back is None:
+        return escape_character + 'c[{}]'.format(_ctos(fore))
+    return escape_character + 'c[{},{}]'.format(_ctos(fore), _ctos(back))
+
+
 def escape(msg):
     """Takes a raw IRC message and returns a girc-escaped message."""
-    msg = msg.replace(escape_character, 'girc-escaped-character')
-    for escape_key, irc_char in format_dict.items():
-        msg = msg.replace(irc_char, escape_character + escape_key)
+    msg = msg.translate(_escape_table)
 
     # convert colour codes
-    new_msg = ''
-    while len(msg):
-        if msg.startswith(escape_character + 'c'):
-            new_msg += msg[:2]
-            msg = msg[2:]
-
-            if not len(msg):
-                new_msg += '[]'
-                continue
+    if format_dict['c'] in msg:
+        msg = _irc_colours.sub(_escape_colours, msg)
 
-            colours, msg = extract_irc_colours(msg)
-            new_msg += colours
-        else:
-            new_msg += msg[0]
-            msg = msg[1:]
-
-    new_msg = new_msg.replace('girc-escaped-character', escape_character + escape_character)
-    return new_msg
+    return msg
 
 
 def _get_from_format_dict(format_dict, key):
@@ -162,103 +171,368 @@ def _get_from_format_dict(format_dict, key):
         return function(*args, **kwargs)
 
 
+# ${name}, $c with optional [colours], or $ and a single character
+_girc_escapes = re.compile(r'\$(?:\{([^}]*)\}|c(?:\[+([^\]]*)\])?|(.))', re.DOTALL)
+
+
+# tokens that always unescape to the same thing. $$ is handled here as well,
+#   otherwise we mess up and double escape characters while escaping and unescaping
+_simple_unescapes = {escape_character + escape_key: irc_char
+                     for escape_key, irc_char in format_dict.items()}
+_simple_unescapes[escape_character + escape_character] = escape_character
+
+_digits = frozenset('0123456789')
+
+# girc colours we've seen, mapped to IRC colour codes
+_colour_codes = {}
+
+
+def _unescape_colours(colours):
+    """Return IRC colour codes for the given girc colours, or None if they're invalid."""
+    try:
+        return _colour_codes[colours]
+    except KeyError:
+        pass
+
+    names = colours.split(',')
+    if len(names) > 2 or any(name not in colour_name_to_code for name in names):
+        return None
+    codes = ','.join(str(colour_name_to_code[name]) for name in names)
+
+    # only valid colours are remembered, so this stays small
+    _colour_codes[colours] = codes
+    return codes
+
+
 def unescape(msg, extra_format_dict={}):
     """Takes a girc-escaped message and returns a raw IRC message"""
-    new_msg = ''
+    if escape_character not in msg:
+        return msg
+
+    if extra_format_dict:
+        formats = dict(extra_format_dict)
+        formats.update(format_dict)
+    else:
+        formats = format_dict
 
-    extra_format_dict.update(format_dict)
+    def unescape_match(match):
+        value = _simple_unescapes.get(match.group())
+        if value is not None:
+            return value
 
-    while len(msg):
-        char = msg[0]
-        msg = msg[1:]
-        if char == escape_character:
-            escape_key = msg[0]
-            msg = msg[1:]
+        name, colours, escape_key = match.groups()
 
-            # we handle this character separately, otherwise we mess up and
-            #   double escape characters while escaping and unescaping
-            if escape_key == escape_character:
-                new_msg += escape_character
+        if name is not None:
+            return _get_from_format_dict(formats, name)
+        elif escape_key is not None:
+            return _get_from_format_dict(formats, escape_key)
 
-            elif escape_key == '{':
-                buf = ''
-                new_char = ''
-                while True:
-                    new_char = msg[0]
-                    msg = msg[1:]
+        # colours
+        value = _get_from_format_dict(formats, 'c')
+        if colours is not None:
+            codes = _unescape_colours(colours)
+            if codes is None:
+                # not colours after all, so unescape them like the rest of the message
+                return value + unescape(match.group()[2:], extra_format_dict)
+            value += codes
 
-                    if new_char == '}':
-                        break
-                    else:
-                        buf += new_char
+            # digits straight after the colour would otherwise become part of it
+            if msg[match.end():match.end() + 1] in _digits:
+                value = _pad_trailing_colour(value)
+        return value
 
-                new_msg += _get_from_format_dict(extra_format_dict, buf)
+    return _girc_escapes.sub(unescape_match, msg)
 
-            else:
-                new_msg += _get_from_format_dict(extra_format_dict, escape_key)
 
-            if escape_key == 'c':
-                fill_last = len(msg) and msg[0] in digits
-                colours, msg = extract_girc_colours(msg, fill_last)
-                new_msg += colours
-        else:
-            new_msg += char
+_cached_unescape = functools.lru_cache(maxsize=1024)(unescape)
+
+
+def cached_unescape(msg):
+    """Same as :func:`unescape`, but remembers results for the messages we send most."""
+    # casemapped strings compare equal to other cases of themselves, so key on plain strs
+    return _cached_unescape(str(msg))
+
+
+# {name} is a slot, {{ and }} are literal braces, and girc's ${name} is left alone
+_template_tokens = re.compile(r'\$\{[^}]*\}|\{\{|\}\}|\{(\w+)\}')
+
+# colour codes at the very end of a piece of text
+_trailing_colour = re.compile('\x03([0-9]{1,2})(?:,([0-9]{1,2}))?$')
+
+
+def _pad_trailing_colour(text):
+    """Zero-pad the colour code at the end of text, so digits after it don't change it."""
+    match = _trailing_colour.search(text)
+    if match is None:
+        return text
+    fore, back = match.groups()
+    if back is None:
+        return text[:match.start()] + '\x03' + fore.zfill(2)
+    return text[:match.start()] + '\x03{},{}'.format(fore, back.zfill(2))
 
-    return new_msg
+
+class Template:
+    """A girc-formatted message with ``{name}`` slots, unescaped once and rendered often.
+
+    Values are inserted as-is, so formatting codes in them aren't unescaped. Use
+    ``{{`` and ``}}`` for literal braces. The result is a raw IRC message, so send it
+    with ``formatted=False``::
+
+        welcome = Template('$bWelcome$r to $c[red]{channel}$r, {nick}!')
+        server.msg(channel, welcome.render(channel=channel, nick=nick), formatted=False)
+    """
+
+    __slots__ = ('source', '_literals', '_fields')
+
+    def __init__(self, source, extra_format_dict={}):
+        self.source = source
+
+        # pieces of unescaped text, with a slot between each one
+        self._literals = []
+        self._fields = []
+
+        escaped = ''
+        last_end = 0
+        for match in _template_tokens.finditer(source):
+            escaped += source[last_end:match.start()]
+            last_end = match.end()
+
+            name = match.group(1)
+            token = match.group()
+            if name is None:
+                escaped += token if token.startswith(escape_character) else token[0]
+                continue
+
+            self._literals.append(_pad_trailing_colour(unescape(escaped, extra_format_dict)))
+            self._fields.append(name)
+            escaped = ''
+
+        escaped += source[last_end:]
+        self._literals.append(unescape(escaped, extra_format_dict))
+
+    @property
+    def fields(self):
+        """Names of the slots in this template."""
+        return list(self._fields)
+
+    def render(self, **values):
+        """Return a raw IRC message with the given values in our slots."""
+        literals = self._literals
+        if not self._fields:
+            return literals[0]
+
+        pieces = [literals[0]]
+        for i, name in enumerate(self._fields):
+            pieces.append(str(values[name]))
+            pieces.append(literals[i + 1])
+        return ''.join(pieces)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.source)
+
+
+# formatting codes in raw IRC text, colours use the same rules as escape()
+_irc_formatting = re.compile('{}|[{}]'.format(_irc_colours.pattern, ''.join(
+    irc_char for escape_key, irc_char in format_dict.items() if escape_key != 'c')))
+
+# formatting codes in girc-escaped text, as loosely as remove_formatting_codes has always
+#   accepted them. $$ and ${$} are literal $ characters
+_girc_formatting = re.compile(r'\$(?:\$|\{\$\}|\{[^}]*\}?|'
+                              r'c(?:\d(?:\d(?:,\d{0,2})?|,\d{0,2})?)?(?:\[[^\]]*\]?)?|.|$)',
+                              re.DOTALL)
+
+
+def _strip_girc_formatting(match):
+    if match.group() in ('$$', '${$}'):
+        return escape_character
+    return ''
 
 
 def remove_formatting_codes(line, irc=False):
-    """Remove girc control codes from the given line."""
+    """Remove girc control codes from the given line.
+
+    If ``irc`` is True, the line is raw IRC text and IRC control codes are removed instead.
+    """
     if irc:
-        line = escape(line)
-    new_line = ''
-    while len(line) > 0:
-        try:
-            if line[0] == '$':
-                line = line[1:]
-
-                if line[0] == '$':
-                    new_line += '$'
-                    line = line[1:]
-
-                elif line[0] == 'c':
-                    line = line[1:]
-                    if line[0].isdigit():
-                        line = line[1:]
-                        if line[0].isdigit():
-                            line = line[1:]
-                            if line[0] == ',':
-                                line = line[1:]
-                                if line[0].isdigit():
-                                    line = line[1:]
-                                    if line[0].isdigit():
-                                        line = line[1:]
-                        elif line[0] == ',':
-                            line = line[1:]
-                            if line[0].isdigit():
-                                line = line[1:]
-                                if line[0].isdigit():
-                                    line = line[1:]
-                    if line[0] == '[':
-                        while line[0] != ']':
-                            line = line[1:]
-                        line = line[1:]
-
-                elif line[0] == '{':
-                    if line[:3] == '{$}':
-                        new_line += '$'
-                        line = line[3:]
-                        continue
-                    while line[0] != '}':
-                        line = line[1:]
-                    line = line[1:]
-
-                else:
-                    line = line[1:]
+        return _irc_formatting.sub('', line)
+    if escape_character not in line:
+        return line
+    return _girc_formatting.sub(_strip_girc_formatting, line)
 
-            else:
-                new_line += line[0]
-                line = line[1:]
-        except IndexError:
+
+# formatting codes are all ascii, so they can be stripped before decoding. colours
+#   have to go first, codes between a colour char and its digits end the colour
+_irc_colours_bytes = re.compile(_irc_colours.pattern.encode())
+_irc_format_chars_bytes = ''.join(irc_char for escape_key, irc_char in format_dict.items()
+                                  if escape_key != 'c').encode()
+
+
+def _strip_bytes(raw):
+    return _irc_colours_bytes.sub(b'', raw).translate(None, _irc_format_chars_bytes)
+
+
+def _stripped_file_lines(file, encoding, errors, chunk_size):
+    leftover = b''
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+
+        # only strip whole lines, so codes are never split between chunks
+        chunk = leftover + chunk
+        end = chunk.rfind(b'\n') + 1
+        if not end:
+            leftover = chunk
             continue
-    return new_line
+        leftover = chunk[end:]
+
+        text = _strip_bytes(chunk[:end - 1]).decode(encoding, errors)
+        for line in text.split('\n'):
+            yield line.rstrip('\r')
+
+    if leftover:
+        yield _strip_bytes(leftover).decode(encoding, errors).rstrip('\r')
+
+
+def strip_formatting_stream(source, encoding='utf-8', errors='replace', chunk_size=1048576):
+    """Yield lines of raw IRC text with formatting removed, for bulk processing.
+
+    Lines are yielded without their line endings.
+
+    Args:
+        source: Binary file object, or an iterable of raw IRC lines as str or bytes.
+        encoding (str): Encoding used to decode bytes.
+        errors (str): How to handle decoding errors, as with ``bytes.decode``.
+        chunk_size (int): How much of a file to read at once.
+    """
+    if hasattr(source, 'read'):
+        yield from _stripped_file_lines(source, encoding, errors, chunk_size)
+        return
+
+    for line in source:
+        if isinstance(line, bytes):
+            line = _strip_bytes(line).decode(encoding, errors)
+        else:
+            line = _irc_formatting.sub('', line)
+        yield line.rstrip('\r\n')
+
+
+Span = collections.namedtuple('Span', ['text', 'bold', 'italic', 'underline', 'fore', 'back'])
+Span.__doc__ = """A run of text that's all formatted the same way.
+
+``fore`` and ``back`` are IRC colour codes, or None if the colour isn't set.
+"""
+
+
+def parse_spans(msg, escaped=False):
+    """Return the given message as a list of :class:`Span` objects.
+
+    The message is parsed in a single pass, and the spans can then be rendered to
+    whichever formats you like with :func:`spans_to_text`, :func:`spans_to_ansi` or
+    :func:`spans_to_html`.
+
+    Args:
+        msg (str): Raw IRC message, or a girc-escaped one if ``escaped`` is True.
+        escaped (bool): Whether the message is girc-escaped.
+    """
+    if escaped:
+        msg = unescape(msg)
+
+    spans = []
+    bold = italic = underline = False
+    fore = back = None
+
+    position = 0
+    for match in _irc_formatting.finditer(msg):
+        if match.start() > position:
+            spans.append(Span(msg[position:match.start()], bold, italic, underline, fore, back))
+        position = match.end()
+
+        code = msg[match.start()]
+        if code == format_dict['b']:
+            bold = not bold
+        elif code == format_dict['i']:
+            italic = not italic
+        elif code == format_dict['u']:
+            underline = not underline
+        elif code == format_dict['r']:
+            bold = italic = underline = False
+            fore = back = None
+        else:
+            new_fore, new_back = match.groups()
+            if new_fore is None:
+                fore = back = None
+            else:
+                fore = int(new_fore)
+                if new_back is not None:
+                    back = int(new_back)
+
+    if position < len(msg):
+        spans.append(Span(msg[position:], bold, italic, underline, fore, back))
+
+    return spans
+
+
+def spans_to_text(spans):
+    """Render the given spans as plain text."""
+    return ''.join(span.text for span in spans)
+
+
+# closest standard terminal colours to each IRC colour
+_ansi_colours = [97, 30, 34, 32, 91, 31, 35, 33, 93, 92, 36, 96, 94, 95, 90, 37]
+
+
+def spans_to_ansi(spans):
+    """Render the given spans as text with ANSI escape codes, for terminals."""
+    out = []
+    for span in spans:
+        codes = ['0']
+        if span.bold:
+            codes.append('1')
+        if span.italic:
+            codes.append('3')
+        if span.underline:
+            codes.append('4')
+        if span.fore is not None and span.fore < len(_ansi_colours):
+            codes.append(str(_ansi_colours[span.fore]))
+        if span.back is not None and span.back < len(_ansi_colours):
+            codes.append(str(_ansi_colours[span.back] + 10))
+
+        out.append('\x1b[{}m'.format(';'.join(codes)))
+        out.append(span.text)
+
+    if out:
+        out.append('\x1b[0m')
+    return ''.join(out)
+
+
+# mIRC's colours
+_html_colours = ['#ffffff', '#000000', '#00007f', '#009300', '#ff0000', '#7f0000', '#9c009c',
+                 '#fc7f00', '#ffff00', '#00fc00', '#009393', '#00ffff', '#0000fc', '#ff00ff',
+                 '#7f7f7f', '#d2d2d2']
+
+
+def spans_to_html(spans):
+    """Render the given spans as HTML, with formatting applied using inline styles."""
+    out = []
+    for span in spans:
+        text = html.escape(span.text)
+
+        styles = []
+        if span.bold:
+            styles.append('font-weight: bold')
+        if span.italic:
+            styles.append('font-style: italic')
+        if span.underline:
+            styles.append('text-decoration: underline')
+        if span.fore is not None and span.fore < len(_html_colours):
+            styles.append('color: {}'.format(_html_colours[span.fore]))
+        if span.back is not None and span.back < len(_html_colours):
+            styles.append('background-color: {}'.format(_html_colours[span.back]))
+
+        if styles:
+            out.append('<span style="{}">{}</span>'.format('; '.join(styles), text))
+        else:
+            out.append(text)
+
+    return ''.join(out)
@@ -1,72 +1,185 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
-from functools import partial
 import collections
 import encodings.idna
+import functools
+import itertools
 import string
+import weakref
+
+# lower and upper characters for each standard
+# rfc3454 handled by nameprep function
+_std_chars = {
+    'ascii': (string.ascii_lowercase, string.ascii_uppercase),
+    'rfc1459': (string.ascii_lowercase + ''.join(chr(i) for i in range(123, 127)),
+                string.ascii_uppercase + ''.join(chr(i) for i in range(91, 95))),
+    'rfc1459-strict': (string.ascii_lowercase + ''.join(chr(i) for i in range(123, 126)),
+                       string.ascii_uppercase + ''.join(chr(i) for i in range(91, 94))),
+}
+
+# translation tables are only built once, and shared between every casemap
+_lower_trans = {std: str.maketrans(upper, lower) for std, (lower, upper) in _std_chars.items()}
+_upper_trans = {std: str.maketrans(lower, upper) for std, (lower, upper) in _std_chars.items()}
+
+# every change to any casemap gets a new generation, so strings can tell
+#   whether the folded keys they've cached are still valid
+_generations = itertools.count()
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_nameprep(value):
+    return encodings.idna.nameprep(value)
+
+
+def nameprep(value):
+    """Return the rfc3454 nameprep of the given string.
+
+    Nameprep is slow, so results are remembered. For ascii strings it's the
+    same as ``str.lower``, so we skip it for those entirely.
+    """
+    if type(value) is not str:
+        value = str(value)
+    try:
+        value.encode('ascii')
+    except UnicodeEncodeError:
+        return _cached_nameprep(value)
+    return str.lower(value)
+
+
+class Casemap:
+    """An IRC casemapping standard, shared between casemapped objects.
+
+    Each server connection holds a single casemap that every string, list and
+    dict it creates points to, so changing the server's standard changes it
+    for all of them at once.
+
+    Folded names are remembered, so folding a popular nick or channel name
+    only happens once rather than on every lookup. We remember at most
+    ``max_folds`` names, and forget them all when the standard changes.
+
+    A ``provisional`` casemap is one whose standard may still change, like a
+    server's before ISUPPORT arrives. It keeps weak references to the lists
+    and dicts that follow it, and re-keys them all when the standard changes.
+    Call :meth:`settle` once the standard is final to stop keeping track.
+    """
+
+    __slots__ = ('std', 'generation', 'max_folds', '_folds', '_containers', '_lower_trans',
+                 '_upper_trans')
+
+    def __init__(self, std=None, max_folds=5000, provisional=False):
+        self.std = None
+        self.generation = next(_generations)
+        self.max_folds = max_folds
+        self._folds = collections.OrderedDict()
+        # lists and dicts aren't hashable, so these are keyed by id
+        self._containers = weakref.WeakValueDictionary() if provisional else None
+        self._lower_trans = None
+        self._upper_trans = None
 
+        if std is not None:
+            self.set_std(std)
 
-class IMap:
-    """Base object for supporting IRC casemapping."""
+    def set_std(self, std):
+        """Set the standard we'll be using (isupport CASEMAPPING)."""
+        self.std = std.lower()
+        self._lower_trans = _lower_trans.get(self.std)
+        self._upper_trans = _upper_trans.get(self.std)
+        self.generation = next(_generations)
+        self._folds.clear()
 
-    def __init__(self):
-        self._std = None
+        if self._containers:
+            for container in list(self._containers.values()):
+                container._refold()
 
-        self._lower_chars = None
-        self._upper_chars = None
+    def register(self, container):
+        """Re-key the given list or dict if our standard changes before we settle."""
+        if self._containers is not None:
+            self._containers[id(container)] = container
 
-        self._lower_trans = None
-        self._upper_trans = None
+    def settle(self):
+        """Our standard won't change again, so stop keeping track of containers."""
+        self._containers = None
 
-    def _set_transmaps(self):
-        """Set translation maps for our standard."""
-        if self._std == 'ascii':
-            self._lower_chars = string.ascii_lowercase
-            self._upper_chars = string.ascii_uppercase
+    def translate(self, value):
+        if self.std == 'rfc3454':
+            return nameprep(value)
 
-        elif self._std == 'rfc1459':
-            self._lower_chars = (string.ascii_lowercase +
-                                 ''.join(chr(i) for i in range(123, 127)))
-            self._upper_chars = (string.ascii_uppercase +
-                                 ''.join(chr(i) for i in range(91, 95)))
+        if self._lower_trans is not None:
+            return str.translate(value, self._lower_trans)
+        return value
 
-        elif self._std == 'rfc1459-strict':
-            self._lower_chars = (string.ascii_lowercase +
-                                 ''.join(chr(i) for i in range(123, 126)))
-            self._upper_chars = (string.ascii_uppercase +
-                                 ''.join(chr(i) for i in range(91, 94)))
+    def lower(self, value):
+        """Return the lower-case equivalent of the given string."""
+        # key on a plain str, IStrings hash themselves using this method
+        if type(value) is not str:
+            value = str(value)
+
+        try:
+            return self._folds[value]
+        except KeyError:
+            pass
+
+        folded = str.lower(self.translate(value))
+        if self.max_folds:
+            if len(self._folds) >= self.max_folds:
+                self._folds.popitem(last=False)
+            self._folds[value] = folded
+        return folded
+
+    def upper(self, value):
+        """Return the upper-case equivalent of the given string."""
+        if self._upper_trans is not None:
+            value = str.translate(value, self._upper_trans)
+        else:
+            value = self.translate(value)
+        return str.upper(value)
 
-        # rfc3454 handled by nameprep function
 
-    def set_std(self, std):
-        """Set the standard we'll be using (isupport CASEMAPPING)."""
-        if not hasattr(self, '_std'):
-            IMap.__init__(self)
+# casemaps for objects that aren't created by a server connection
+_casemaps = {}
+
+
+def get_casemap(std):
+    """Return a shared casemap for the given standard."""
+    std = std.lower()
+    if std not in _casemaps:
+        _casemaps[std] = Casemap(std)
+    return _casemaps[std]
+
+
+class IMap:
+    """Base object for supporting IRC casemapping."""
 
-        # translation based on std
-        self._std = std.lower()
+    __slots__ = ()
 
-        # set casemapping maps
-        self._set_transmaps()
+    def __init__(self):
+        self._casemap = _null_casemap
 
-        # create translations
-        if self._lower_chars:
-            self._lower_trans = str.maketrans(self._upper_chars, self._lower_chars)
-        if self._upper_chars:
-            self._upper_trans = str.maketrans(self._lower_chars, self._upper_chars)
+    @property
+    def _std(self):
+        return self._casemap.std
+
+    def set_std(self, std):
+        """Set the standard we'll be using (isupport CASEMAPPING)."""
+        self._casemap = get_casemap(std)
+
+    def set_casemap(self, casemap):
+        """Follow the given casemap, usually one shared with a server."""
+        self._casemap = casemap
 
     def _translate(self, value):
-        if self._std == 'rfc3454':
-            return encodings.idna.nameprep(value)
+        return self._casemap.translate(value)
 
-        if self._lower_trans is not None:
-            return value.translate(self._lower_trans)
+
+_null_casemap = Casemap()
 
 
 class IDict(collections.MutableMapping, IMap):
     """Case-insensitive IRC dict, based on IRC casemapping standards."""
 
+    __slots__ = ('store', '_casemap', '__weakref__')
+
     def __init__(self, data={}, *args, **kwargs):
         self.store = dict()
         IMap.__init__(self)
@@ -95,14 +208,28 @@ class IDict(collections.MutableMapping, IMap):
     def __len__(self):
         return len(self.store)
 
+    def set_casemap(self, casemap):
+        self._casemap = casemap
+        casemap.register(self)
+
+    def _refold(self):
+        """Re-key our store after our casemap's standard changes."""
+        store = self.store
+        self.store = dict()
+        for key, value in store.items():
+            self.store[self.__keytransform__(key)] = value
+
     def __keytransform__(self, key):
+        if isinstance(key, IString) and key._casemap is self._casemap:
+            return key._key()
         if isinstance(key, str):
-            key = self._translate(key)
+            return self._casemap.lower(key)
         return key.lower()
 
     def copy(self):
         """Return a copy of ourself."""
-        new_dict = IDict(std=self._std)
+        new_dict = IDict()
+        new_dict.set_casemap(self._casemap)
         new_dict.update(self.store)
         return new_dict
 
@@ -110,6 +237,8 @@ class IDict(collections.MutableMapping, IMap):
 class IList(collections.MutableSequence, IMap):
     """Case-insensitive IRC list, based on IRC casemapping standards."""
 
+    __slots__ = ('store', '_casemap', '__weakref__')
+
     def __init__(self, data=[], *args):
         self.store = list()
         IMap.__init__(self)
@@ -123,13 +252,24 @@ class IList(collections.MutableSequence, IMap):
     def __repr__(self):
         return str(self.store)
 
+    def set_casemap(self, casemap):
+        self._casemap = casemap
+        casemap.register(self)
+
+    def _refold(self):
+        """Re-fold our contents after our casemap's standard changes."""
+        self.store = [self.__valuetransform__(value) for value in self.store]
+
     def __valuetransform__(self, value):
-        # XXX - could also simply make them IStrings
-        #   or do some more complex processing on them below...
+        if isinstance(value, IString) and value._casemap is self._casemap:
+            return value._key()
         if isinstance(value, str):
-            value = self._translate(value)
+            return self._casemap.lower(value)
         return value
 
+    def __contains__(self, value):
+        return self.__valuetransform__(value) in self.store
+
     def __getitem__(self, index):
         return self.store[index]
 
@@ -152,12 +292,7 @@ class IList(collections.MutableSequence, IMap):
         self.store = []
 
     def extend(self, values):
-        if isinstance(values, (list, tuple)):
-            for value in values:
-                value = self.__valuetransform__(value)
-                self.store.append(value)
-        else:
-            self.store += self.__valuetransform__(values)
+        self.store.extend(self.__valuetransform__(value) for value in values)
 
     def insert(self, index, value):
         value = self.__valuetransform__(value)
@@ -175,99 +310,120 @@ class IList(collections.MutableSequence, IMap):
 
 
 class CarelessStr(str):
+    __slots__ = ()
+
     def __new__(cls, *args, **kwargs):
         return super(CarelessStr, cls).__new__(cls, *args[:1])
 
 
 class IString(CarelessStr, IMap):
-    """Case-insensitive IRC string (for channel/usernames), based on IRC casemapping."""
+    """Case-insensitive IRC string (for channel/usernames), based on IRC casemapping.
+
+    Our lower-case form is worked out the first time it's needed and kept
+    around, so comparing and hashing strings is as cheap as it is for a
+    normal str. It's only worked out again if our casemap changes.
+    """
+
+    __slots__ = ('_casemap', '_folded', '_generation', '__weakref__')
 
     def __new__(cls, *args, **kwargs):
-        self = CarelessStr.__new__(IString, *args, **kwargs)
+        self = CarelessStr.__new__(cls, *args, **kwargs)
         IMap.__init__(self)
+        self._folded = None
+        self._generation = None
         return self
 
     def __init__(self, *args, **kwargs):
-        self = CarelessStr.__new__(IString, *args, **kwargs)
-        IMap.__init__(self)
+        # everything's set up in __new__, this just stops IMap's __init__ running
+        pass
+
+    def _key(self):
+        """Return our lower-case equivalent as a plain str."""
+        casemap = self._casemap
+        if self._generation != casemap.generation:
+            self._folded = casemap.lower(self)
+            self._generation = casemap.generation
+        return self._folded
+
+    def _other_key(self, other):
+        """Return the lower-case equivalent of the given string, given our std."""
+        if isinstance(other, IString) and other._casemap is self._casemap:
+            return other._key()
+        return self._casemap.lower(other)
+
+    def _new(self, value):
+        new_string = IString(value)
+        new_string._casemap = self._casemap
+        return new_string
 
     def lower(self):
-        new_string = IString(self._irc_lower(self))
-        new_string.set_std(self._std)
-        return new_string
+        return self._new(self._key())
 
     def upper(self):
-        new_string = IString(self._irc_upper(self))
-        new_string.set_std(self._std)
-        return new_string
+        return self._new(self._irc_upper(self))
 
     def _irc_lower(self, in_string):
         """Convert us to our lower-case equivalent, given our std."""
-        conv_string = self._translate(in_string)
-        if self._lower_trans is not None:
-            conv_string = conv_string.translate(self._lower_trans)
-        return str.lower(conv_string)
+        return self._casemap.lower(in_string)
 
     def _irc_upper(self, in_string):
         """Convert us to our upper-case equivalent, given our std."""
-        conv_string = self._translate(in_string)
-        if self._upper_trans is not None:
-            conv_string = in_string.translate(self._upper_trans)
-        return str.upper(conv_string)
+        return self._casemap.upper(in_string)
 
     # magic
     def __contains__(self, item):
-        me = str(self.lower())
-        item = str(self._irc_lower(item))
-        return item in me
+        return self._other_key(item) in self._key()
 
     def __eq__(self, other):
-        # use str's built-in equality operator
-        me = str(self.lower())
-        other = str(self._irc_lower(other))
-        return me == other
+        if not isinstance(other, str):
+            return NotImplemented
+        return self._key() == self._other_key(other)
+
+    def __ne__(self, other):
+        if not isinstance(other, str):
+            return NotImplemented
+        return self._key() != self._other_key(other)
 
     def __lt__(self, other):
-        for i in range(0, min(len(self), len(other))):
-            if ord(self[i]) < ord(self[i]):
-                return True
-        return len(self) < len(other)
+        if not isinstance(other, str):
+            return NotImplemented
+        return self._key() < self._other_key(other)
 
     def __le__(self, other):
-        return self.__lt__(other) or len(self) < len(other)
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
+        if not isinstance(other, str):
+            return NotImplemented
+        return self._key() <= self._other_key(other)
 
     def __gt__(self, other):
-        return not self.__le__(other)
+        if not isinstance(other, str):
+            return NotImplemented
+        return self._key() > self._other_key(other)
 
     def __ge__(self, other):
-        return not self.__lt__(other)
+        if not isinstance(other, str):
+            return NotImplemented
+        return self._key() >= self._other_key(other)
 
     def __hash__(self):
-        return hash(str(self._irc_lower(self)))
-
-    # str methods
-    # this is so we can just do normal .title() / .split() / .etc calls
-    #   as though IString were a normal str class
-    def __getattribute__(self, name):
-        f = str.__getattribute__(self, name)
-
-        if not callable(f):
-            return f
-
-        this_dict = object.__getattribute__(self, '__dict__')
-        if '_std' in this_dict:
-            this_std = object.__getattribute__(self, '_std')
-
-        def callback(*args, **kwargs):
-            r = f(*args, **kwargs)
-            if isinstance(r, str):
-                new_string = IString(r)
-                if '_std' in this_dict:
-                    new_string.set_std(this_std)
-                return new_string
-            return r
-
-        return partial(callback)
+        return hash(self._key())
+
+
+# str methods that return strings give back IStrings using the same casemap,
+#   so we can just do normal .title() / .strip() / .etc calls as though
+#   IString were a normal str class
+def _wrap_str_method(name):
+    method = getattr(str, name)
+
+    def wrapper(self, *args, **kwargs):
+        return self._new(method(self, *args, **kwargs))
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+for _name in ('capitalize', 'casefold', 'center', 'expandtabs', 'format', 'format_map',
+              'join', 'ljust', 'lstrip', 'removeprefix', 'removesuffix', 'replace', 'rjust',
+              'rstrip', 'strip', 'swapcase', 'title', 'translate', 'zfill'):
+    if hasattr(str, _name):
+        setattr(IString, _name, _wrap_str_method(_name))
+del _name
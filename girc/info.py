@@ -1,8 +1,25 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
+import asyncio
+from collections import OrderedDict
+import time
+
 from .types import User, Channel, Server
-from .utils import NickMask, CaseInsensitiveDict, sort_prefixes
+from .utils import NickMask, CaseInsensitiveDict
+
+loop = asyncio.get_event_loop()
+
+# numerics telling us we couldn't join a channel
+_join_failures = (
+    'nosuchchannel',
+    'toomanychannels',
+    'channelisfull',
+    'inviteonlychan',
+    'bannedfromchan',
+    'badchannelkey',
+    'badchanmask',
+)
 
 
 class Info:
@@ -19,7 +36,14 @@ class Info:
 
     The ``users`` dict should only contain users we share channels with, or
     have sent us messages / commands. If we do not share a channel with a user,
-    they may be removed from here at any time.
+    they may be removed from here at any time. We keep up to
+    ``max_unshared_users`` of these users around, removing the least recently
+    seen ones first, and remove any that haven't been seen for
+    ``unshared_user_ttl`` seconds. Either of these can be set to ``None`` to
+    disable that limit. Once we're connected, stale users are also looked for
+    every ``evict_interval`` seconds, so they're removed even if the connection
+    goes quiet. When a user is removed, the ``evict user`` girc event is
+    dispatched.
 
     The ``servers`` dict will contain all the servers we have received
     communications from in the past. We don't store much info for each server,
@@ -35,13 +59,28 @@ class Info:
         self.channels = self.s.idict()
         self.servers = CaseInsensitiveDict()
 
+        # users we don't share any channels with, least recently seen first
+        self.max_unshared_users = 1000
+        self.unshared_user_ttl = 3600
+        self._unshared_users = OrderedDict()
+        self.evict_interval = 60
+        self._evict_timer = None
+
         # internal event handlers
         self._in_handlers = {
             'join': self.in_join_handler,
             'part': self.in_part_handler,
+            'kick': self.in_kick_handler,
             'quit': self.in_quit_handler,
             'cmode': self.in_cmode_handler,
+            'namreply': self.in_namreply_handler,
+            'endofnames': self.in_endofnames_handler,
         }
+        for verb in _join_failures:
+            self._in_handlers[verb] = self.in_join_failed_handler
+
+        # after reconnecting, channels we're rejoining mapped to the nicks we've seen in them
+        self._resyncing = self.s.idict()
 
     # base event handlers
     def handle_event_in(self, event):
@@ -61,62 +100,131 @@ class Info:
         ...
 
     # specific event handlers
+    # with minimal tracking, users are plain strings and we only have Channel
+    #   objects for the channels we're in, so these handlers accept both
     def in_join_handler(self, event):
-        user = event['source']
-        channels = event['channels']
-
-        for chan in channels:
-            if chan.name not in user.channel_names:
-                user.channel_names.append(chan.name)
+        nick = NickMask(event['source']).nick
 
-            if user.nick not in chan.users:
-                chan.users[user.nick] = {}
+        for chan in event['channels']:
+            if not isinstance(chan, Channel):
+                continue
 
-            if user.nick not in chan.prefixes:
-                chan.prefixes[user.nick] = ''
+            chan.add_user(nick, prefixes=chan.prefixes.get(nick) or '')
 
-            if user.nick == self.s.nick:
+            if nick == self.s.nick:
                 chan.joined = True
-
-            if user.is_me:
                 chan.get_modes()
 
     def in_part_handler(self, event):
-        user = event['source']
-        channels = event['channels']
+        nick = NickMask(event['source']).nick
 
-        for chan in channels:
-            if user.nick in chan.users:
-                del chan.users[user.nick]
+        for chan in event['channels']:
+            if not isinstance(chan, Channel):
+                continue
 
-            if user.nick in chan.prefixes:
-                del chan.prefixes[user.nick]
+            chan.remove_user(nick)
 
-            if chan.name in user.channel_names:
-                user.channel_names.remove(chan.name)
+            if nick == self.s.nick:
+                self._left_channel(chan)
 
-            if user.nick == self.s.nick:
-                chan.joined = False
+    def in_kick_handler(self, event):
+        chan = event['channel']
+        nick = event['user']
+
+        if not isinstance(chan, Channel):
+            return
+
+        chan.remove_user(nick)
+
+        if nick == self.s.nick:
+            self._left_channel(chan)
 
     def in_quit_handler(self, event):
         user = event['source']
 
-        for chan in user.channels:
-            if user.nick in chan.users:
-                del chan.users[user.nick]
+        if isinstance(user, User):
+            nick = user.nick
+            channels = user.channels
+        else:
+            nick = NickMask(user).nick
+            channels = [chan for chan in self.channels.values() if nick in chan.prefixes]
+
+        for chan in channels:
+            chan.remove_user(nick)
+
+            if nick == self.s.nick:
+                self._left_channel(chan)
+
+    def in_namreply_handler(self, event):
+        seen = self._resyncing.get(event['params'][2])
+        if seen is None:
+            return
+
+        for user in event['prefixes']:
+            seen[user.nick if isinstance(user, User) else user] = True
+
+    def in_endofnames_handler(self, event):
+        seen = self._resyncing.pop(event['params'][1], None)
+        chan = self.channels.get(event['params'][1])
+        if seen is None or chan is None:
+            return
+
+        # remove everyone who left while we were away
+        for nick in list(chan._user_nicks):
+            if nick not in seen:
+                chan.remove_user(nick)
+
+    def in_join_failed_handler(self, event):
+        if len(event['params']) < 2 or self._resyncing.pop(event['params'][1], None) is None:
+            return
+
+        chan = self.channels.get(event['params'][1])
+        if chan is not None:
+            self._left_channel(chan)
+
+    def start_resync(self):
+        """Get ready to resync our channels after reconnecting.
+
+        Rather than starting from scratch, we keep our channels and users around.
+        When we rejoin each channel, its NAMES reply tells us who's still there, and
+        we only remove the users who left while we were away. Channels we can't
+        rejoin are removed.
+
+        Returns:
+            list: The channels to rejoin, as ``'name key'`` or ``'name'`` strings.
+        """
+        self._resyncing = self.s.idict()
+
+        rejoin = []
+        for name, chan in self.channels.items():
+            chan.joined = False
+            self._resyncing[name] = self.s.idict()
+
+            key = chan.modes.get('k')
+            if isinstance(key, str):
+                rejoin.append('{} {}'.format(name, key))
+            else:
+                rejoin.append(name)
 
-            if user.nick in chan.prefixes:
-                del chan.prefixes[user.nick]
+        return rejoin
 
-            if chan.name in user.channel_names:
-                user.channel_names.remove(chan.name)
+    def _left_channel(self, chan):
+        """We've left the given channel, so we no longer share it with anyone."""
+        chan.joined = False
 
-            if user.nick == self.s.nick:
-                chan.joined = False
+        for nick in list(chan._user_nicks):
+            chan.remove_user(nick)
+
+        if self.channels.get(chan.name) is chan:
+            del self.channels[chan.name]
 
     def in_cmode_handler(self, event):
         channel = event['channel']
-        prefixes = event['server'].features.get('prefix')
+        if not isinstance(channel, Channel):
+            return
+
+        features = event['server'].features
+        prefix_bits = features.prefix_mode_bits
 
         for unary, char, argument in event['modes']:
             if unary == '+':
@@ -124,9 +232,10 @@ class Info:
                     if char in channel.modes and isinstance(channel.modes[char], list):
                         if argument not in channel.modes[char]:
                             channel.modes[char].append(argument)
-                    elif char in prefixes:
-                        sorted_prefix_list = ''.join(reversed(list(prefixes.values())))
-                        channel.prefixes[argument] = sort_prefixes(channel.prefixes[argument] + prefixes[char], sorted_prefix_list)
+                    elif char in prefix_bits:
+                        if argument in channel.prefixes:
+                            mask = features.prefix_mask(channel.prefixes[argument])
+                            channel.prefixes[argument] = features.prefix_string(mask | prefix_bits[char])
                     else:
                         channel.modes[char] = argument
                 else:
@@ -136,8 +245,10 @@ class Info:
                     if char in channel.modes and isinstance(channel.modes[char], list):
                         if argument in channel.modes[char]:
                             channel.modes[char].remove(argument)
-                    elif char in prefixes:
-                        channel.prefixes[argument] = channel.prefixes[argument].replace(prefixes[char], '')
+                    elif char in prefix_bits:
+                        if argument in channel.prefixes:
+                            mask = features.prefix_mask(channel.prefixes[argument])
+                            channel.prefixes[argument] = features.prefix_string(mask & ~prefix_bits[char])
                 else:
                     if char in channel.modes:
                         del channel.modes[char]
@@ -157,14 +268,81 @@ class Info:
                 'user': new_user,
             })
 
-        # XXX - rewriting these every time...
-        #   do we wanna check if they're the same before we do the writes?
+        # these leave the user alone if nothing's changed, so their cached masks are kept
         self.users[user.nick].nick = user.nick
         if user.user:
             self.users[user.nick].user = user.user
         if user.host:
             self.users[user.nick].host = user.host
 
+        self.touch_user(self.users[user.nick])
+
+    def touch_user(self, user):
+        """Note that we've just seen the given user.
+
+        Users we don't share any channels with are put into our unshared user
+        cache, and may be evicted from our info later on.
+        """
+        self._unshared_users.pop(user, None)
+
+        if user.channel_names or user.is_me:
+            return
+
+        self._unshared_users[user] = time.monotonic()
+        self.evict_users(keep=user)
+
+    def evict_users(self, keep=None):
+        """Remove unshared users that are stale or over our cache size.
+
+        Args:
+            keep (girc.types.User): User to never evict, usually the one we've just seen.
+        """
+        if self.unshared_user_ttl is None:
+            expired = None
+        else:
+            expired = time.monotonic() - self.unshared_user_ttl
+
+        while self._unshared_users:
+            user, last_seen = next(iter(self._unshared_users.items()))
+            if user is keep:
+                break
+
+            too_many = (self.max_unshared_users is not None and
+                        len(self._unshared_users) > self.max_unshared_users)
+            too_old = expired is not None and last_seen < expired
+            if not (too_many or too_old):
+                break
+
+            del self._unshared_users[user]
+
+            # they may have joined a channel or been replaced since we saw them
+            if user.channel_names or self.users.get(user.nick) is not user:
+                continue
+
+            del self.users[user.nick]
+            self.s._girc_events.dispatch('evict user', {
+                'server': self.s,
+                'user': user,
+            })
+
+    def start_evicting(self):
+        """Start regularly removing stale users."""
+        self.stop_evicting()
+        if self.evict_interval:
+            self._evict_timer = loop.call_later(self.evict_interval, self._evict_tick)
+
+    def stop_evicting(self):
+        """Stop regularly removing stale users."""
+        if self._evict_timer is not None:
+            self._evict_timer.cancel()
+            self._evict_timer = None
+
+    def _evict_tick(self):
+        self._evict_timer = None
+        if self.s.connected:
+            self.evict_users()
+            self.start_evicting()
+
     def create_channel(self, channel):
         self.create_channels(channel)
 
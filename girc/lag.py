@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import asyncio
+import collections
+import itertools
+import time
+
+loop = asyncio.get_event_loop()
+
+
+def percentile(samples, percent):
+    """Return the given percentile of some samples, or None if there aren't any.
+
+    Args:
+        samples (iterable): Numbers to look through.
+        percent (float): Percentile to return, from 0 to 100.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = int(round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class LagMonitor:
+    """Measures lag on a server connection.
+
+    Once we're connected, we send a PING with a unique token every ``interval``
+    seconds and time how long the server takes to PONG it back. We also time how
+    long we take to handle the data we receive, so a slow network can be told
+    apart from a slow bot. The latest ``window`` samples of each are kept, in
+    ``rtts`` and ``processing``.
+
+    Each PONG dispatches a ``lag`` ``girc`` event containing the ``server`` and
+    the ``rtt`` in seconds.
+
+    Args:
+        server_connection (girc.client.ServerConnection): Server to measure.
+        interval (float): Seconds between PINGs, or None to not send them.
+        window (int): How many samples to keep.
+    """
+
+    def __init__(self, server_connection, interval=60, window=100):
+        self.s = server_connection
+        self.interval = interval
+
+        self.rtts = collections.deque(maxlen=window)
+        self.processing = collections.deque(maxlen=window)
+
+        # tokens we've sent mapped to when we sent them, oldest first
+        self._pending = collections.OrderedDict()
+        self._tokens = itertools.count()
+        self._timer = None
+
+    def start(self):
+        """Start sending PINGs."""
+        self.stop()
+        if self.interval:
+            self._timer = loop.call_later(self.interval, self._tick)
+
+    def stop(self):
+        """Stop sending PINGs, and forget the ones we're waiting on."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending.clear()
+
+    def _tick(self):
+        self._timer = None
+        if self.s.connected:
+            self.ping()
+            self.start()
+
+    def ping(self):
+        """Send a PING to measure our round-trip time."""
+        token = 'girc-lag-{}'.format(next(self._tokens))
+        self._pending[token] = time.monotonic()
+
+        # the server may never answer some of these
+        while len(self._pending) > 10:
+            self._pending.popitem(last=False)
+
+        self.s.send('PING', params=[token])
+
+    def rpl_pong(self, event):
+        if not event['params']:
+            return
+        sent = self._pending.pop(event['params'][-1], None)
+        if sent is None:
+            return
+
+        rtt = time.monotonic() - sent
+        self.rtts.append(rtt)
+        self.s._girc_events.dispatch('lag', {
+            'server': self.s,
+            'rtt': rtt,
+        })
+
+    @property
+    def rtt(self):
+        """Our latest round-trip time in seconds, or None if we haven't measured one."""
+        if self.rtts:
+            return self.rtts[-1]
+        return None
+
+    @property
+    def current(self):
+        """Our current lag in seconds.
+
+        This is our latest round-trip time, or how long we've been waiting for our
+        oldest unanswered PING if that's longer.
+        """
+        lag = self.rtt
+        if self._pending:
+            waiting = time.monotonic() - next(iter(self._pending.values()))
+            if lag is None or waiting > lag:
+                lag = waiting
+        return lag
+
+    def stats(self, percents=(50, 90, 99)):
+        """Return percentiles of our round-trip and processing times.
+
+        Returns:
+            dict: Like ``{'rtt': {50: 0.1, 90: 0.3, 99: 0.5}, 'processing': {...}}``.
+        """
+        return {
+            'rtt': {percent: percentile(self.rtts, percent) for percent in percents},
+            'processing': {percent: percentile(self.processing, percent)
+                           for percent in percents},
+        }
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+
+
+def handler_name(handler):
+    """Return a readable name for the given event handler."""
+    name = getattr(handler, '__qualname__', None) or getattr(handler, '__name__', None)
+    if name is None:
+        return repr(handler)
+
+    module = getattr(handler, '__module__', None)
+    if module:
+        return '{}.{}'.format(module, name)
+    return name
+
+
+class DispatchProfiler:
+    """Records how long each event handler takes.
+
+    Stats are kept for every server, direction, verb and handler. Handlers that
+    take longer than ``budget`` seconds dispatch a ``slow handler`` ``girc`` event
+    on their server, containing the ``server``, ``direction``, ``verb``,
+    ``handler`` and how many ``seconds`` it took.
+
+    Args:
+        budget (float): Seconds a handler can take before we warn about it, or None to
+            never warn.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+
+        # (server, direction, verb, handler) mapped to [calls, total, max, errors]
+        self._stats = {}
+
+    def record(self, label, verb, handler, seconds, error=False):
+        """Record a single call of the given handler."""
+        server, direction = label
+        key = (server, direction, verb, handler)
+
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]:
+            stats[2] = seconds
+        if error:
+            stats[3] += 1
+
+        if self.budget is not None and seconds > self.budget:
+            # don't warn about slow warning handlers, or they'd warn forever
+            if direction == 'girc' and verb == 'slow handler':
+                return
+
+            server._girc_events.dispatch('slow handler', {
+                'server': server,
+                'direction': direction,
+                'verb': verb,
+                'handler': handler,
+                'seconds': seconds,
+            })
+
+    def snapshot(self):
+        """Return stats for every handler we've seen, slowest in total first.
+
+        Returns:
+            list: Dicts containing the ``server`` name, ``direction``, ``verb``,
+            ``handler`` name, number of ``calls``, ``total``, ``mean`` and ``max`` seconds,
+            and how many calls raised ``errors``.
+        """
+        snapshot = []
+        for (server, direction, verb, handler), stats in self._stats.items():
+            calls, total, longest, errors = stats
+            snapshot.append({
+                'server': server.name,
+                'direction': direction,
+                'verb': verb,
+                'handler': handler_name(handler),
+                'calls': calls,
+                'total': total,
+                'mean': total / calls,
+                'max': longest,
+                'errors': errors,
+            })
+
+        snapshot.sort(key=lambda entry: entry['total'], reverse=True)
+        return snapshot
+
+    def reset(self):
+        """Forget everything we've recorded."""
+        self._stats = {}
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import asyncio
+import collections
+import heapq
+import itertools
+import random
+import time
+
+loop = asyncio.get_event_loop()
+
+
+class ReconnectScheduler:
+    """Reconnects dropped server connections with backoff and jitter.
+
+    When a network goes down, every connection to it drops at once. So that we
+    don't stampede it (and get throttled) when it comes back, each server waits
+    a randomised, exponentially growing delay between attempts, and only
+    ``max_concurrent`` servers are reconnecting at any one time. A server stops
+    counting towards that limit once it's ready, or when it drops again.
+
+    Args:
+        max_concurrent (int): How many servers can be reconnecting at once.
+        min_delay (float): Seconds to wait before the first attempt.
+        max_delay (float): Most seconds to wait between attempts.
+        jitter (float): Fraction of each delay that's randomised, from 0 to 1.
+    """
+
+    def __init__(self, max_concurrent=10, min_delay=1, max_delay=300, jitter=0.5):
+        self.max_concurrent = max_concurrent
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+        # failed attempts in a row for each server
+        self.attempts = {}
+
+        # servers that have waited out their delay, and servers reconnecting now
+        self._waiting = collections.deque()
+        self._active = set()
+        self._timers = {}
+
+    def delay(self, attempt):
+        """Return how many seconds to wait before the given attempt, counting from 0."""
+        delay = min(self.max_delay, self.min_delay * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def schedule(self, server):
+        """Reconnect the given server once its backoff delay has passed."""
+        attempt = self.attempts.get(server, 0)
+
+        # this server may have been holding a slot
+        self.forget(server)
+
+        self.attempts[server] = attempt + 1
+        delay = self.delay(attempt)
+
+        self._timers[server] = loop.call_later(delay, self._queue, server)
+        server._girc_events.dispatch('reconnect scheduled', {
+            'server': server,
+            'attempt': attempt + 1,
+            'delay': delay,
+        })
+
+    def forget(self, server):
+        """Stop reconnecting the given server, because it's ready or has quit."""
+        timer = self._timers.pop(server, None)
+        if timer is not None:
+            timer.cancel()
+        if server in self._waiting:
+            self._waiting.remove(server)
+        self._active.discard(server)
+        self.attempts.pop(server, None)
+
+        self._start_waiting()
+
+    def _queue(self, server):
+        del self._timers[server]
+        self._waiting.append(server)
+        self._start_waiting()
+
+    def _start_waiting(self):
+        while self._waiting and len(self._active) < self.max_concurrent:
+            server = self._waiting.popleft()
+            self._active.add(server)
+            server._reconnect()
+
+
+class ConnectScheduler:
+    """Staggers connecting lots of servers at once.
+
+    Opening every socket and running every CAP and SASL handshake at the same time
+    spikes our CPU use and trips servers' connection throttles. Instead, servers
+    wait their turn here, lowest ``priority`` first. Only ``max_concurrent`` are
+    connecting at once (a server stops counting once it's ready, or if it fails
+    to connect), and we wait at least ``host_interval`` seconds between starting
+    connections to the same host.
+
+    How long each server took to become ready after we started connecting it is
+    stored in ``ready_times``, keyed by server name.
+
+    Args:
+        max_concurrent (int): How many servers can be connecting at once.
+        host_interval (float): Least seconds between connections to the same host.
+    """
+
+    def __init__(self, max_concurrent=20, host_interval=1):
+        self.max_concurrent = max_concurrent
+        self.host_interval = host_interval
+        self.ready_times = {}
+
+        # (priority, order, server, host) entries, and servers connecting now
+        self._waiting = []
+        self._order = itertools.count()
+        self._active = {}
+
+        # when we last started connecting to each host
+        self._host_starts = {}
+        self._timer = None
+
+    def request(self, server, host=None, priority=10):
+        """Connect the given server once it's its turn.
+
+        Args:
+            server (girc.client.ServerConnection): Server to connect.
+            host (str): Host we're connecting to, for rate limiting.
+            priority (int): Lower priorities connect first.
+        """
+        heapq.heappush(self._waiting, (priority, next(self._order), server, host))
+        self._start_waiting()
+
+    def ready(self, server):
+        """The given server is ready, so let the next one start connecting.
+
+        Returns:
+            float: Seconds it took to become ready, or None if we didn't connect it.
+        """
+        started = self._active.pop(server, None)
+        if started is None:
+            return None
+
+        taken = time.monotonic() - started
+        self.ready_times[server.name] = taken
+
+        self._start_waiting()
+        return taken
+
+    def forget(self, server):
+        """Stop connecting the given server, because it failed or has quit."""
+        self._active.pop(server, None)
+
+        waiting = [entry for entry in self._waiting if entry[2] is not server]
+        if len(waiting) != len(self._waiting):
+            heapq.heapify(waiting)
+            self._waiting = waiting
+
+        self._start_waiting()
+
+    def _start_waiting(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        now = time.monotonic()
+        throttled = []
+        next_start = None
+
+        while self._waiting and len(self._active) < self.max_concurrent:
+            entry = heapq.heappop(self._waiting)
+            priority, order, server, host = entry
+
+            last_start = self._host_starts.get(host)
+            if last_start is not None and now < last_start + self.host_interval:
+                throttled.append(entry)
+                if next_start is None or last_start + self.host_interval < next_start:
+                    next_start = last_start + self.host_interval
+                continue
+
+            self._host_starts[host] = now
+            self._active[server] = now
+            server._open_connection()
+
+        for entry in throttled:
+            heapq.heappush(self._waiting, entry)
+
+        # check again once a throttled host frees up
+        if next_start is not None and len(self._active) < self.max_concurrent:
+            self._timer = loop.call_later(next_start - now, self._start_waiting)
+
+
+# used by servers that don't belong to a reactor
+default_reconnector = ReconnectScheduler()
+default_connector = ConnectScheduler()
@@ -1,19 +1,25 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
-from .formatting import unescape
+from .formatting import cached_unescape
 from .utils import NickMask
 
 
 class TargetableUserChan:
     """Provides events that can be sent to a user or a channel."""
 
+    __slots__ = ()
+
+    @property
+    def _target(self):
+        return self.name
+
     def msg(self, message, formatted=True, tags=None):
         self.s.msg(self._target, message, formatted=formatted, tags=tags)
 
     def me(self, message, formatted=True):
         if formatted:
-            message = unescape(message)
+            message = cached_unescape(message)
 
         self.ctcp('ACTION', message)
 
@@ -33,28 +39,36 @@ class TargetableUserChan:
 class ServerConnected:
     """Something that's connected to an IRC server."""
 
+    __slots__ = ('s',)
+
+    is_user = False
+    is_channel = False
+    is_server = False
+
     def __init__(self, server_connection):
         self.s = server_connection
 
-        self.is_user = False
-        self.is_channel = False
-        self.is_server = False
+
+def _unchanged(record, attr, value):
+    """Return whether the given slot already holds exactly this value, case included."""
+    current = getattr(record, attr, None)
+    return current is not None and str.__eq__(current, value) is True
 
 
 class User(ServerConnected, TargetableUserChan):
     """An IRC user."""
 
+    __slots__ = ('_nick', '_user', '_host', '_userhost', '_nickmask', 'channel_names', 'is_me')
+
+    is_user = True
+
     def __init__(self, server_connection, nickmask):
         super().__init__(server_connection)
 
-        self.is_user = True
-
         user = NickMask(nickmask)
-        self.nick = self.s.istring(user.nick)
-        self.user = self.s.istring(user.user)
-        self.host = self.s.istring(user.host)
-
-        self._target = self.nick
+        self.nick = user.nick
+        self.user = user.user
+        self.host = user.host
 
         self.channel_names = self.s.ilist()
 
@@ -62,6 +76,42 @@ class User(ServerConnected, TargetableUserChan):
         self.is_me = server_connection.nick is None or (self.nick == server_connection.nick)
 
     # properties
+    @property
+    def nick(self):
+        return self._nick
+
+    @nick.setter
+    def nick(self, nick):
+        if _unchanged(self, '_nick', nick):
+            return
+        self._nick = self.s.istring(nick)
+        self._nickmask = None
+
+    # idents and hosts are shared between lots of users, so we intern them
+    @property
+    def user(self):
+        return self._user
+
+    @user.setter
+    def user(self, user):
+        if _unchanged(self, '_user', user):
+            return
+        self._user = self.s.istring(user, intern=True)
+        self._userhost = None
+        self._nickmask = None
+
+    @property
+    def host(self):
+        return self._host
+
+    @host.setter
+    def host(self, host):
+        if _unchanged(self, '_host', host):
+            return
+        self._host = self.s.istring(host, intern=True)
+        self._userhost = None
+        self._nickmask = None
+
     @property
     def name(self):
         return self.nick
@@ -70,8 +120,9 @@ class User(ServerConnected, TargetableUserChan):
     def channels(self):
         chanlist = []
 
+        # channels we aren't tracking are given by name
         for channel in self.channel_names:
-            chanlist.append(self.s.info.channels[channel])
+            chanlist.append(self.s.info.channels.get(channel, channel))
 
         return chanlist
 
@@ -79,28 +130,33 @@ class User(ServerConnected, TargetableUserChan):
     def channels(self, chanlist):
         self.channel_names = self.s.ilist(chanlist)
 
+    # these are worked out when first asked for, and again after our nick/ident/host change
     @property
     def userhost(self):
-        return '{}@{}'.format(self.user, self.host)
+        if self._userhost is None:
+            self._userhost = '{}@{}'.format(self.user, self.host)
+        return self._userhost
 
     @property
     def nickmask(self):
-        return '{}!{}@{}'.format(self.nick, self.user, self.host)
+        if self._nickmask is None:
+            self._nickmask = '{}!{}@{}'.format(self.nick, self.user, self.host)
+        return self._nickmask
 
 
 class Channel(ServerConnected, TargetableUserChan):
     """An IRC channel."""
 
+    __slots__ = ('name', 'joined', '_user_nicks', 'prefixes', 'modes')
+
+    is_channel = True
+
     def __init__(self, server_connection, name):
         super().__init__(server_connection)
 
-        self.is_channel = True
-
         self.name = self.s.istring(name)
         self.joined = False  # whether we are joined to this channel
 
-        self._target = self.name
-
         self._user_nicks = self.s.ilist()
         self.prefixes = self.s.idict()
 
@@ -109,17 +165,16 @@ class Channel(ServerConnected, TargetableUserChan):
     def _init_modes(self):
         self.modes = {}
 
-        a, b, c, d = self.s.features.available['chanmodes']
-
-        for char in a:
+        for char in self.s.features.list_modes:
             self.modes[char] = []
 
     @property
     def users(self):
         userlist = {}
 
+        # with minimal tracking we don't keep users around, so we give their nicks
         for nick in self._user_nicks:
-            userlist[nick] = self.s.info.users[nick]
+            userlist[nick] = self.s.info.users.get(nick, nick)
 
         return userlist
 
@@ -128,40 +183,53 @@ class Channel(ServerConnected, TargetableUserChan):
         if isinstance(user, User):
             user = user.nick
 
-        user_prefixes = self.prefixes.get(user, None)
-
-        if not user_prefixes:
-            return False
-
-        mode_dict = self.s.features.available['prefix']
-
-        caught = False
+        features = self.s.features
+        threshold = features.privs_masks.get(lowest_mode)
 
-        for mode, prefix in mode_dict.items():
-            if mode in lowest_mode and not caught:
-                caught = True
-            elif mode not in lowest_mode and not caught:
-                continue
+        # several modes given, in which case the lowest counts
+        if threshold is None:
+            threshold = 0
+            for mode in lowest_mode:
+                threshold |= features.privs_masks.get(mode, 0)
 
-            if prefix in user_prefixes:
-                return True
-
-        return False
+        return bool(features.prefix_mask(self.prefixes.get(user)) & threshold)
 
     def add_user(self, nick, prefixes=None):
         """Add a user to our internal list of nicks."""
         if nick not in self._user_nicks:
             self._user_nicks.append(nick)
 
-        self.prefixes[nick] = prefixes
+        features = self.s.features
+        self.prefixes[nick] = features.prefix_string(features.prefix_mask(prefixes))
+
+        # so the user doesn't get removed from our info while we share this channel
+        user = self.s.info.users.get(nick)
+        if user is not None and self.name not in user.channel_names:
+            user.channel_names.append(self.name)
+            self.s.info.touch_user(user)
+
+    def remove_user(self, nick):
+        """Remove a user from our internal list of nicks."""
+        if nick in self._user_nicks:
+            self._user_nicks.remove(nick)
+
+        if nick in self.prefixes:
+            del self.prefixes[nick]
+
+        user = self.s.info.users.get(nick)
+        if user is not None and self.name in user.channel_names:
+            user.channel_names.remove(self.name)
+            self.s.info.touch_user(user)
 
 
 class Server(ServerConnected):
     """An IRC server."""
 
+    __slots__ = ('name',)
+
+    is_server = True
+
     def __init__(self, server_connection, name):
         super().__init__(server_connection)
 
-        self.is_server = True
-
         self.name = self.s.istring(name)
@@ -2,6 +2,9 @@
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
 import collections
+import datetime
+import functools
+import re
 import string
 
 
@@ -19,47 +22,163 @@ def sort_prefixes(orig, prefixes='@+'):
     return new
 
 
-def parse_modes(params, mode_types=None, prefixes=''):
+def batch_joins(channels, max_length=512):
+    """Group channels into as few JOIN commands as fit in the given line length.
+
+    Channels with keys are put first, since keys apply to channels in order.
+
+    Args:
+        channels (list): ``(name, key)`` tuples, where ``key`` is None for channels without one.
+        max_length (int): Longest line to build, including the trailing CRLF.
+
+    Returns:
+        list: JOIN params for each command, like ``['#a,#b', 'key']``.
+    """
+    batches = []
+    names = []
+    keys = []
+    base_length = len('JOIN  \r\n')
+    length = base_length
+
+    for name, key in sorted(channels, key=lambda channel: not channel[1]):
+        extra = len(name) + 1
+        if key:
+            extra += len(key) + 1
+        if names and length + extra > max_length:
+            batches.append([','.join(names)] + ([','.join(keys)] if keys else []))
+            names = []
+            keys = []
+            length = base_length
+
+        names.append(name)
+        if key:
+            keys.append(key)
+        length += extra
+
+    if names:
+        batches.append([','.join(names)] + ([','.join(keys)] if keys else []))
+    return batches
+
+
+def compile_mode_table(mode_types=None, prefixes=''):
+    """Return a table classifying channel modes, for use with :func:`parse_modes`.
+
+    The table maps each mode character to an ``(arg_on_set, arg_on_unset, is_list, rank)``
+    tuple. ``rank`` is the mode's position in PREFIX counting up from the lowest privilege,
+    or None for modes that aren't prefix modes.
+
+    Args:
+        mode_types (list): CHANMODES-like mode types.
+        prefixes (str): PREFIX-like mode types, from lowest to highest privilege.
+    """
+    if mode_types is None:
+        mode_types = ['', '', '', '']
+    list_modes, always_modes, set_modes = (list(mode_types) + ['', '', ''])[:3]
+
+    table = {}
+    for char in set_modes:
+        table[char] = (True, False, False, None)
+    for char in always_modes:
+        table[char] = (True, True, False, None)
+    for char in list_modes:
+        table[char] = (True, True, True, None)
+    for rank, char in enumerate(prefixes):
+        table[char] = (True, True, False, rank)
+    return table
+
+
+def parse_modes(params, mode_types=None, prefixes='', table=None):
     """Return a modelist.
 
     Args:
         params (list of str): Parameters from MODE event.
         mode_types (list): CHANMODES-like mode types.
         prefixes (str): PREFIX-like mode types.
+        table (dict): Mode table from :func:`compile_mode_table`, used instead of
+            ``mode_types`` and ``prefixes`` if given.
     """
     # we don't accept bare strings because we don't want to try to do
     #   intelligent parameter splitting
-    params = list(params)
+    mode_string = params[0]
 
-    if params[0][0] not in '+-':
+    if mode_string[0] not in '+-':
         raise Exception('first param must start with + or -')
 
-    if mode_types is None:
-        mode_types = ['', '', '', '']
-
-    mode_string = params.pop(0)
-    args = params
+    if table is None:
+        table = compile_mode_table(mode_types, prefixes)
 
     assembled_modes = []
-    direction = mode_string[0]
+    args = params[1:]
+    arg_count = len(args)
+    arg_index = 0
+    direction = '+'
+    arg_column = 0
     for char in mode_string:
-        if char in '+-':
+        if char == '+' or char == '-':
             direction = char
+            arg_column = 0 if char == '+' else 1
             continue
 
-        if (char in mode_types[0] or char in mode_types[1] or char in prefixes or
-                (char in mode_types[2] and direction == '+') and len(args)):
-            value = args.pop(0)
+        mode_type = table.get(char)
+        if mode_type is not None and mode_type[arg_column] and arg_index < arg_count:
+            assembled_modes.append([direction, char, args[arg_index]])
+            arg_index += 1
         else:
-            value = None
-
-        assembled_modes.append([direction, char, value])
+            assembled_modes.append([direction, char, None])
 
     return assembled_modes
 
 
+@functools.lru_cache(maxsize=256)
+def _parse_server_time_seconds(value):
+    return datetime.datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                             int(value[11:13]), int(value[14:16]),
+                             int(value[17:19])).timetuple()
+
+
+def parse_server_time(value):
+    """Return a struct_time for the given server-time tag value, or None if it's malformed.
+
+    Server times look like ``2011-10-19T16:40:51.620Z``. The result is the same as
+    ``time.strptime`` would give, but much quicker, and results are remembered for
+    each second since messages tend to arrive in bursts.
+    """
+    if (len(value) < 20 or value[-1] != 'Z' or value[4] != '-' or value[7] != '-' or
+            value[10] != 'T' or value[13] != ':' or value[16] != ':'):
+        return None
+
+    # optional fractional seconds
+    if len(value) > 20 and (value[19] != '.' or not value[20:-1].isdigit()):
+        return None
+
+    try:
+        return _parse_server_time_seconds(value[:19])
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_nickmask(mask):
+    if '!' in mask:
+        nick, rest = mask.split('!', 1)
+        if '@' in rest:
+            user, host = rest.split('@', 1)
+        else:
+            user, host = rest, ''
+        return nick, user, host
+    elif '@' in mask:
+        nick, host = mask.split('@', 1)
+        return nick, '', host
+    return mask, '', ''
+
+
 class NickMask:
-    """An IRC nickmask."""
+    """An IRC nickmask.
+
+    Parsed masks are remembered, since we see the same ones over and over.
+    """
+
+    __slots__ = ('nick', 'user', 'host')
 
     def __init__(self, mask):
         if isinstance(mask, NickMask):
@@ -70,20 +189,8 @@ class NickMask:
         elif hasattr(mask, 'nickmask'):
             mask = mask.nickmask
 
-        self.nick = ''
-        self.user = ''
-        self.host = ''
-
-        if '!' in mask:
-            self.nick, rest = mask.split('!', 1)
-            if '@' in rest:
-                self.user, self.host = rest.split('@', 1)
-            else:
-                self.user = rest
-        elif '@' in mask:
-            self.nick, self.host = mask.split('@', 1)
-        else:
-            self.nick = mask
+        # casemapped strings compare equal to other cases of themselves, so key on plain strs
+        self.nick, self.user, self.host = _parse_nickmask(str(mask))
 
     @property
     def userhost(self):
@@ -146,6 +253,44 @@ class CaseInsensitiveList(collections.MutableSequence):
         return self
 
 
+class CaseInsensitiveSet(collections.MutableSet):
+    """A case-insensitive ``set``-like object, for casefolded lookups in O(1)."""
+
+    def __init__(self, data=None):
+        self.__store = set()
+
+        if data:
+            for value in data:
+                self.add(value)
+
+    def __contains__(self, value):
+        if isinstance(value, str):
+            value = value.casefold()
+
+        return value in self.__store
+
+    def __iter__(self):
+        return iter(self.__store)
+
+    def __len__(self):
+        return len(self.__store)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, sorted(self.__store))
+
+    def add(self, value):
+        if isinstance(value, str):
+            value = value.casefold()
+
+        self.__store.add(value)
+
+    def discard(self, value):
+        if isinstance(value, str):
+            value = value.casefold()
+
+        self.__store.discard(value)
+
+
 # CaseInsensitiveDict from requests.
 #
 # Copyright 2015 Kenneth Reitz
@@ -251,3 +396,54 @@ def validate_hostname(hostname):
         if part.translate(hostname_allowed_chars_tbl) != '':
             return False
     return True
+
+
+# we cannot assume how long nicknames can be for other users based on NICKLEN,
+#   spec forbids it
+_nick_pattern = re.compile(r'^[a-z_\-\[\]\\^{}|`][a-z0-9_\-\[\]\\^{}|`]+$', re.IGNORECASE)
+
+
+class NameClassifier:
+    """Works out whether names are channels, servers or nicks.
+
+    Results are remembered for recently-seen names, so a new classifier should
+    be made whenever CHANTYPES changes.
+
+    Args:
+        chantypes (str): CHANTYPES-like channel prefix characters.
+        max_names (int): How many names to remember.
+    """
+
+    __slots__ = ('chantypes', 'max_names', '_kinds')
+
+    def __init__(self, chantypes='#', max_names=4096):
+        self.chantypes = frozenset(chantypes)
+        self.max_names = max_names
+        self._kinds = collections.OrderedDict()
+
+    def classify(self, name):
+        """Return 'channel', 'server' or 'nick' for the given name, or None if it's none of them."""
+        # casemapped strings compare equal to other cases of themselves, so key on plain strs
+        if type(name) is not str:
+            name = str(name)
+
+        try:
+            return self._kinds[name]
+        except KeyError:
+            pass
+
+        if not name:
+            kind = None
+        elif name[0] in self.chantypes:
+            kind = 'channel'
+        elif '.' in name and validate_hostname(name):
+            kind = 'server'
+        elif _nick_pattern.match(name):
+            kind = 'nick'
+        else:
+            kind = None
+
+        if len(self._kinds) >= self.max_names:
+            self._kinds.popitem(last=False)
+        self._kinds[name] = kind
+        return kind
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+"""Performance benchmarks.
+
+These are skipped by default because they take a while and their results
+depend on the machine running them. Run them with::
+
+    GIRC_BENCHMARK=1 python3 -m unittest -v tests.test_benchmarks
+"""
+import encodings.idna
+import functools
+import gc
+import os
+import string
+import time
+import tracemalloc
+import unittest
+from unittest import mock
+
+from girc.client import ServerConnection
+from girc.events import Event, MessageEvent
+from girc.utils import NickMask
+
+from .test_info import create_server
+
+run_benchmarks = unittest.skipUnless(os.environ.get('GIRC_BENCHMARK'),
+                                     'set GIRC_BENCHMARK=1 to run benchmarks')
+
+
+def report(name, value, unit):
+    print('\n  {}: {:,.2f} {}'.format(name, value, unit), end=' ')
+
+
+def timed(function, *args, repeat=3):
+    """Return the best time out of a few runs of the given function."""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        taken = time.perf_counter() - start
+        if best is None or taken < best:
+            best = taken
+    return best
+
+
+class ReferenceIMap:
+    """How casemapped objects were stored before they shared their server's casemap.
+
+    Each string, list and dict built and kept its own translation tables. This
+    is only kept around so benchmarks can compare against it.
+    """
+
+    def set_std(self, std):
+        self._std = std
+        self._lower_chars = string.ascii_lowercase
+        self._upper_chars = string.ascii_uppercase
+        self._lower_trans = str.maketrans(self._upper_chars, self._lower_chars)
+        self._upper_trans = str.maketrans(self._lower_chars, self._upper_chars)
+
+
+class ReferenceIString(str, ReferenceIMap):
+    pass
+
+
+class ReferenceIList(ReferenceIMap):
+    def __init__(self):
+        self.store = []
+
+
+class ReferenceUser:
+    """How users were stored before they were slotted and shared their idents and hosts."""
+
+    def __init__(self, server, nickmask):
+        self.s = server
+        self.is_user = True
+        self.is_channel = False
+        self.is_server = False
+
+        user = NickMask(nickmask)
+        self.nick = server.istring(user.nick)
+        self.user = server.istring(user.user)
+        self.host = server.istring(user.host)
+        self._target = self.nick
+
+        self.channel_names = server.ilist()
+        self.is_me = False
+
+
+class ReferenceServer:
+    """Just enough of a server to track reference users."""
+
+    def __init__(self):
+        self.users = {}
+
+    def istring(self, value):
+        new_string = ReferenceIString(value)
+        new_string.set_std('ascii')
+        return new_string
+
+    def ilist(self):
+        new_list = ReferenceIList()
+        new_list.set_std('ascii')
+        return new_list
+
+    def create_user(self, nickmask):
+        user = ReferenceUser(self, nickmask)
+        self.users[user.nick.translate(user.nick._lower_trans)] = user
+
+        # these were then overwritten with plain strings
+        mask = NickMask(nickmask)
+        user.nick = mask.nick
+        user.user = mask.user
+        user.host = mask.host
+
+
+@run_benchmarks
+class MemoryBenchmarkTestCase(unittest.TestCase):
+    """Benchmarks memory used by our state tracking."""
+
+    def measure_users(self, create_server):
+        """Return how many bytes each user takes when tracked by the given server."""
+        user_count = 20000
+
+        gc.collect()
+        tracemalloc.start()
+        server, users = create_server()
+        start = tracemalloc.get_traced_memory()[0]
+
+        # idents and hosts repeat across users, like on real networks
+        for i in range(user_count):
+            server.create_user('nick{}!~ident{}@host-{}.example.com'.format(i, i % 50,
+                                                                           i % 200))
+
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+
+        self.assertEqual(len(users), user_count)
+        return used / user_count
+
+    def test_bytes_per_user(self):
+        def create_server():
+            server = ServerConnection(name='benchmark')
+            server.set_casemapping('rfc1459')
+            server.nick = server.istring('girc')
+            server.info.max_unshared_users = None
+            return server.info, server.info.users
+
+        def create_reference_server():
+            server = ReferenceServer()
+            return server, server.users
+
+        report('memory per tracked user', self.measure_users(create_server), 'bytes')
+        report('memory per tracked user, unshared casemaps',
+               self.measure_users(create_reference_server), 'bytes')
+
+
+@run_benchmarks
+class DispatchBenchmarkTestCase(unittest.TestCase):
+    """Benchmarks handling incoming lines."""
+
+    def run_pubmsg(self, profile=False, **kwargs):
+        line_count = 5000
+
+        s = create_server(**kwargs)
+        if profile:
+            s.enable_profiling()
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n')
+
+        seen = []
+        s.register_event('in', 'pubmsg', lambda event: seen.append(event['message']))
+
+        data = b''.join(':nick{}!~ident@host-{}.example.com PRIVMSG #chan :hello there, '
+                        'how are you?\r\n'.format(i % 500, i % 50).encode()
+                        for i in range(line_count))
+
+        taken = timed(s.data_received, data)
+
+        self.assertEqual(len(seen), line_count * 3)
+        return line_count / taken
+
+    def test_pubmsg(self):
+        report('pubmsg lines per second', self.run_pubmsg(), 'lines/s')
+
+    def test_pubmsg_typed_events(self):
+        report('pubmsg lines per second, typed events', self.run_pubmsg(typed_events=True),
+               'lines/s')
+
+    def test_pubmsg_profiled(self):
+        report('pubmsg lines per second, profiled', self.run_pubmsg(profile=True), 'lines/s')
+
+    def test_mass_modes(self):
+        line_count = 2000
+
+        s = create_server(tracking='none')
+        s.features.ingest('PREFIX=(qaohv)~&@%+', 'CHANMODES=beI,k,l,imnpst')
+
+        seen = []
+        s.register_event('in', 'cmode', lambda event: seen.append(event['modes']))
+
+        # services opping and banning lots of people at once
+        nicks = ' '.join('nick{}'.format(i) for i in range(12))
+        data = ':ChanServ!services@services.example.com MODE #chan +oooooovvvvvv {}\r\n'
+        data += ':ChanServ!services@services.example.com MODE #chan -bbbbbb+imnt-k {} key\r\n'
+        data = data.format(nicks, ' '.join('*!*@host-{}'.format(i) for i in range(6)))
+        data = data.encode() * (line_count // 2)
+
+        taken = timed(s.data_received, data)
+
+        self.assertEqual(len(seen), line_count * 3)
+        self.assertEqual(seen[0][-1], ['+', 'v', 'nick11'])
+        report('mass mode lines per second', line_count / taken, 'lines/s')
+
+    def test_names(self):
+        line_count = 500
+
+        s = create_server(tracking='none')
+        s.features.ingest('PREFIX=(qaohv)~&@%+')
+
+        seen = []
+        s.register_event('in', 'namreply', lambda event: seen.append(event['users']))
+
+        # joining big channels, where a handful of people hold privileges
+        names = ' '.join('{}nick{}'.format('@' if i % 20 == 0 else '+' if i % 7 == 0 else '', i)
+                         for i in range(400))
+        data = ':irc.example.com 353 girc = #chan :{}\r\n'.format(names).encode() * line_count
+
+        taken = timed(s.data_received, data)
+
+        self.assertEqual(len(seen), line_count * 3)
+        report('names per second', 400 * line_count / taken, 'names/s')
+
+    def test_name_classification(self):
+        s = create_server()
+
+        # what message_to_event sees in busy channels: mostly channel targets and nickmask
+        #   sources, with some private messages and server notices mixed in
+        names = []
+        for i in range(1000):
+            names.append('#chan{}'.format(i % 10))
+            names.append('nick{}!~ident@host-{}.example.com'.format(i % 500, i % 50))
+            if i % 5 == 0:
+                names.append('nick{}'.format(i % 500))
+            if i % 20 == 0:
+                names.append('irc{}.example.com'.format(i % 3))
+
+        def classify():
+            for i in range(10):
+                for name in names:
+                    s.classify(name)
+
+        report('name classifications', 10 * len(names) / timed(classify), 'names/s')
+
+
+@run_benchmarks
+class EventBenchmarkTestCase(unittest.TestCase):
+    """Benchmarks typed events against plain dict events."""
+
+    def setUp(self):
+        s = create_server()
+        self.info = {
+            'server': s,
+            'direction': 'in',
+            'verb': 'pubmsg',
+            'tags': {},
+            'params': ['#chan', 'hi there'],
+            'message': 'hi there',
+        }
+
+    def test_creation(self):
+        def create(event_class):
+            for i in range(100000):
+                event_class(self.info, {})
+
+        report('dict events created', 100000 / timed(create, Event), 'events/s')
+        report('typed events created', 100000 / timed(create, MessageEvent.from_info),
+               'events/s')
+
+    def test_field_reads(self):
+        events = [Event(self.info, {}), MessageEvent.from_info(self.info, {})]
+
+        def read(event):
+            for i in range(100000):
+                event['verb']
+                event['message']
+
+        for event in events:
+            name = 'typed' if isinstance(event, MessageEvent) else 'dict'
+            report('{} event field reads'.format(name), 200000 / timed(read, event),
+                   'reads/s')
+
+        def read_attributes(event):
+            for i in range(100000):
+                event.verb
+                event.message
+
+        report('typed event attribute reads', 200000 / timed(read_attributes, events[1]),
+               'reads/s')
+
+
+class ReferenceCasemap:
+    """How casemaps folded names before they remembered them."""
+
+    def __init__(self):
+        self._lower_trans = str.maketrans(string.ascii_uppercase + '[]\\~',
+                                          string.ascii_lowercase + '{}|^')
+
+    def translate(self, value):
+        return value.translate(self._lower_trans)
+
+    def lower(self, value):
+        return str.lower(self.translate(value))
+
+
+class ReferenceWrappingIString(str):
+    """How IStrings worked before they cached their folded key.
+
+    Comparisons and hashes folded the string again every time, and every method
+    was wrapped when it was looked up, so it'd return IStrings.
+    """
+
+    def __new__(cls, value, casemap):
+        self = str.__new__(cls, value)
+        self._casemap = casemap
+        return self
+
+    def lower(self):
+        return ReferenceWrappingIString(self._casemap.lower(self), self._casemap)
+
+    def __eq__(self, other):
+        me = str(self.lower())
+        other = str(self._casemap.lower(other))
+        return me == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(str(self._casemap.lower(self)))
+
+    def __getattribute__(self, name):
+        f = str.__getattribute__(self, name)
+
+        if not callable(f):
+            return f
+
+        this_casemap = object.__getattribute__(self, '_casemap')
+
+        def callback(*args, **kwargs):
+            r = f(*args, **kwargs)
+            if isinstance(r, str):
+                return ReferenceWrappingIString(r, this_casemap)
+            return r
+
+        return functools.partial(callback)
+
+
+class ReferenceIDict:
+    """How IDicts worked before they used IStrings' cached keys."""
+
+    def __init__(self, casemap):
+        self._casemap = casemap
+        self.store = {}
+
+    def __getitem__(self, key):
+        return self.store[self.__keytransform__(key)]
+
+    def __setitem__(self, key, value):
+        self.store[self.__keytransform__(key)] = value
+
+    def __keytransform__(self, key):
+        if isinstance(key, str):
+            key = self._casemap.translate(key)
+        return key.lower()
+
+
+class ReferenceIMappingServer:
+    """Just enough of a server to make reference casemapped objects."""
+
+    def __init__(self):
+        self.casemap = ReferenceCasemap()
+
+    def istring(self, value):
+        return ReferenceWrappingIString(value, self.casemap)
+
+    def idict(self):
+        return ReferenceIDict(self.casemap)
+
+
+@run_benchmarks
+class IMappingBenchmarkTestCase(unittest.TestCase):
+    """Benchmarks our casemapped objects.
+
+    Each benchmark is also run against a reference copy of our IStrings from before
+    they cached their folded keys.
+    """
+
+    def setUp(self):
+        self.server = ServerConnection(name='benchmark')
+        self.server.set_casemapping('rfc1459')
+
+        self.servers = [('', self.server),
+                        (', before cached keys', ReferenceIMappingServer())]
+
+    def nicks(self, server):
+        return [server.istring('Nick[{}]'.format(i)) for i in range(1000)]
+
+    def test_dict_lookups(self):
+        for name, server in self.servers:
+            nicks = self.nicks(server)
+            users = server.idict()
+            for nick in nicks:
+                users[nick] = nick
+
+            raw_nicks = [str(nick).upper() for nick in nicks]
+
+            def lookup():
+                for i in range(20):
+                    for nick in nicks:
+                        users[nick]
+                    for nick in raw_nicks:
+                        users[nick]
+
+            report('idict lookups' + name, 40 * len(nicks) / timed(lookup), 'lookups/s')
+
+    def test_equality(self):
+        for name, server in self.servers:
+            nicks = self.nicks(server)
+            others = [server.istring(str(nick).lower()) for nick in nicks]
+            pairs = list(zip(nicks, others))
+
+            def compare():
+                for i in range(20):
+                    for nick, other in pairs:
+                        nick == other
+                        nick == 'someone'
+
+            report('istring comparisons' + name, 40 * len(pairs) / timed(compare),
+                   'comparisons/s')
+
+    def test_hashing(self):
+        for name, server in self.servers:
+            nicks = self.nicks(server)
+
+            def add_to_set():
+                for i in range(20):
+                    set(nicks)
+
+            report('istring set insertions' + name, 20 * len(nicks) / timed(add_to_set),
+                   'inserts/s')
+
+    def test_split(self):
+        for name, server in self.servers:
+            line = server.istring(' '.join(self.nicks(server)[:20]))
+
+            def split():
+                for i in range(10000):
+                    line.split(' ')
+
+            report('istring splits' + name, 10000 / timed(split), 'splits/s')
+
+    def test_rfc3454_lookups(self):
+        server = ServerConnection(name='benchmark')
+        server.set_casemapping('rfc3454')
+
+        # more names than the casemap remembers, some of them non-ascii
+        nicks = ['Nick{}'.format(i) for i in range(8000)]
+        nicks += ['Nïck{}'.format(i) for i in range(2000)]
+
+        users = server.idict()
+        for nick in nicks:
+            users[nick] = nick
+
+        def lookup():
+            for nick in nicks:
+                users[nick]
+
+        report('idict lookups, rfc3454', len(nicks) / timed(lookup), 'lookups/s')
+
+        # before we skipped ascii names and remembered the rest, every name the casemap
+        #   had forgotten went through nameprep again
+        with mock.patch('girc.imapping.nameprep',
+                        lambda value: encodings.idna.nameprep(str(value))):
+            report('idict lookups, rfc3454 without memoised nameprep',
+                   len(nicks) / timed(lookup), 'lookups/s')
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import unittest
+
+from girc.capabilities import Capabilities
+
+
+class CapabilitiesTestCase(unittest.TestCase):
+    """Tests our capability tracking."""
+
+    def test_enabled_caps(self):
+        caps = Capabilities(wanted=['echo-message', 'server-time', 'sasl'])
+        caps.ingest('ls', ['*', 'echo-message server-time'])
+        caps.ingest('ls', ['sasl=PLAIN,EXTERNAL batch'])
+
+        self.assertEqual(sorted(caps.to_enable), ['echo-message', 'sasl', 'server-time'])
+        self.assertFalse(caps.echo_message)
+
+        caps.ingest('ACK', ['Echo-Message server-time'])
+        self.assertIn('echo-message', caps.enabled)
+        self.assertIn('SERVER-TIME', caps.enabled)
+        self.assertTrue(caps.echo_message)
+        self.assertTrue(caps.server_time)
+        self.assertFalse(caps.batch)
+
+        caps.ingest('nak', ['sasl'])
+        self.assertNotIn('sasl', caps.enabled)
+
+        caps.ingest('ack', ['-echo-message'])
+        self.assertFalse(caps.echo_message)
+
+        caps.ingest('del', ['server-time'])
+        self.assertFalse(caps.server_time)
+        self.assertNotIn('server-time', caps.available)
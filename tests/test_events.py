@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import json
+import unittest
+
+from girc.events import (Event, MembershipEvent, MessageEvent, ModeEvent, NumericEvent,
+                         ctcp_unpack_message)
+from girc.types import Channel, User
+
+from .test_info import create_server
+
+
+class EventsTestCase(unittest.TestCase):
+    """Tests our event creation."""
+
+    def setUp(self):
+        self.server = create_server()
+        self.server.data_received(b':girc!~g@localhost JOIN #chan\r\n')
+
+        self.events = []
+        self.server.register_event('in', 'all', self.events.append)
+
+    def test_lazy_entities(self):
+        s = self.server
+        s.data_received(b':dan!~lol@localhost PRIVMSG #chan :hi there\r\n')
+        event = self.events[0]
+
+        # users are tracked straight away, but only looked up when they're asked for
+        self.assertEqual(event['message'], 'hi there')
+        self.assertIn('dan', s.info.users)
+        self.assertIn('source', event._lazy)
+
+        self.assertIs(event['source'], s.info.users['dan'])
+        self.assertIs(event['channel'], s.info.channels['#chan'])
+        self.assertIs(event['from_to'], event['channel'])
+        self.assertIs(event.get('will_be_echod'), False)
+
+        # other ways of accessing values work as well
+        s.data_received(b':jess!~lol@localhost PRIVMSG girc :hello\r\n')
+        event = self.events[1]
+
+        self.assertIn('from_to', event)
+        self.assertEqual(event['from_to'].nick, 'jess')
+        self.assertIsInstance(dict(event)['target'], User)
+        self.assertIn('source', event.keys())
+
+    def test_eager_tracking(self):
+        s = self.server
+
+        # nothing reads the source, but we still track them
+        s.data_received(b':newbie!~n@host.example PRIVMSG girc :hi\r\n')
+        self.assertIn('newbie', s.info.users)
+        self.assertEqual(s.info.users['newbie'].host, 'host.example')
+
+    def test_stashed_events(self):
+        s = self.server
+        s.data_received(b':dan!~lol@localhost PRIVMSG #chan :bye\r\n'
+                        b':dan!~lol@localhost QUIT :gone\r\n'
+                        b':girc!~g@localhost PART #chan\r\n')
+        pubmsg = self.events[0]
+        s.info.evict_users()
+
+        # reading an old event doesn't bring back channels we've left, or users
+        #   we've forgotten about
+        self.assertEqual(pubmsg['channel'].name, '#chan')
+        self.assertNotIn('#chan', s.info.channels)
+        self.assertEqual(pubmsg['source'].nick, 'dan')
+
+    def test_missing_from_to(self):
+        self.server.data_received(b':irc.example.com NOTICE girc :server notice\r\n')
+        event = self.events[0]
+
+        self.assertNotIn('from_to', event)
+        self.assertIsNone(event.get('from_to'))
+        with self.assertRaises(KeyError):
+            event['from_to']
+
+    def test_server_time(self):
+        self.server.data_received(b'@time=2011-10-19T16:40:51.620Z :dan!~lol@localhost '
+                                  b'PRIVMSG #chan :hi\r\n'
+                                  b'@time=yesterday :dan!~lol@localhost PRIVMSG #chan :hi\r\n')
+
+        self.assertEqual(self.events[0]['server_time'].tm_hour, 16)
+        self.assertNotIn('server_time', self.events[1])
+
+    def test_ctcp_unpacking(self):
+        info = {'verb': 'pubmsg', 'params': ['#chan', 'hi there']}
+        self.assertEqual(ctcp_unpack_message(info), [['pubmsg', info]])
+
+        infos = ctcp_unpack_message({'verb': 'pubmsg',
+                                     'params': ['#chan', 'a\\\\b\x01ACTION waves \\a\x01']})
+        self.assertEqual(infos[0][1]['params'], ['#chan', 'a\\b'])
+        self.assertEqual(infos[1][0], 'ctcp')
+        self.assertEqual(infos[1][1]['ctcp_verb'], 'action')
+        self.assertEqual(infos[1][1]['ctcp_text'], 'waves \x01')
+
+    def test_state_tracking(self):
+        s = self.server
+
+        # state tracking happens even if no handlers look at the event
+        s.data_received(b':dan!~lol@localhost JOIN #chan\r\n')
+        self.assertIn('dan', s.info.channels['#chan'].users)
+        self.assertIsInstance(self.events[0]['channels'][0], Channel)
+
+
+class TypedEventsTestCase(unittest.TestCase):
+    """Tests our typed events."""
+
+    def setUp(self):
+        self.server = create_server(typed_events=True)
+        self.server.data_received(b':girc!~g@localhost JOIN #chan\r\n')
+
+        self.events = []
+        self.server.register_event('in', 'all', self.events.append)
+
+    def test_event_types(self):
+        s = self.server
+        s.data_received(b':dan!~lol@localhost JOIN #chan\r\n'
+                        b':dan!~lol@localhost PRIVMSG #chan :hi there\r\n'
+                        b':dan!~lol@localhost MODE #chan +o girc\r\n'
+                        b':irc.example.com 366 girc #chan :End of /NAMES list\r\n'
+                        b':irc.example.com PING :token\r\n')
+
+        join, pubmsg, cmode, endofnames, ping = self.events
+
+        self.assertIsInstance(join, MembershipEvent)
+        self.assertIsInstance(pubmsg, MessageEvent)
+        self.assertIsInstance(cmode, ModeEvent)
+        self.assertIsInstance(endofnames, NumericEvent)
+        self.assertIsInstance(ping, Event)
+
+        # state tracking still works with typed events
+        self.assertIn('dan', s.info.channels['#chan'].users)
+        self.assertEqual(s.info.channels['#chan'].prefixes['girc'], '@')
+
+        self.assertEqual(pubmsg.message, 'hi there')
+        self.assertEqual(pubmsg['message'], 'hi there')
+        self.assertIs(pubmsg['source'], s.info.users['dan'])
+        self.assertIs(pubmsg.from_to, s.info.channels['#chan'])
+        self.assertIs(endofnames['channel'], s.info.channels['#chan'])
+
+        self.assertNotIn('modes', pubmsg)
+        self.assertIsNone(pubmsg.get('modes'))
+        with self.assertRaises(KeyError):
+            pubmsg['ctcp_verb']
+        with self.assertRaises(KeyError):
+            pubmsg['_lazy']
+
+    def test_serialize(self):
+        self.server.data_received(b':dan!~lol@localhost PRIVMSG #chan :hi there\r\n')
+
+        self.assertEqual(self.events[0].serialize(), {
+            'server': 'test',
+            'direction': 'in',
+            'verb': 'pubmsg',
+            'tags': {},
+            'source': 'dan!~lol@localhost',
+            'params': ['#chan', 'hi there'],
+            'will_be_echod': False,
+            'target': '#chan',
+            'channel': '#chan',
+            'message': 'hi there',
+            'from_to': '#chan',
+        })
+
+        # events can be stored as JSON
+        self.server.data_received(b':irc.example.com 353 girc = #chan :@girc +dan\r\n')
+        namreply = self.events[1].serialize()
+        self.assertEqual(namreply['source'], 'irc.example.com')
+        self.assertEqual(namreply['users'], ['girc', 'dan'])
+        self.assertEqual(namreply['prefixes'], {'girc': '@', 'dan': '+'})
+        json.dumps(namreply)
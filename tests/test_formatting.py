@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
+import io
 import unittest
 
 from girc import formatting
 
+from .test_benchmarks import report, run_benchmarks, timed
+
+
+def colourful_line(length=512):
+    """Return a raw IRC line of the given length, packed with formatting."""
+    chunk = '\x02bold\x02 \x034,12red on blue\x03 \x1ditalic\x0f $5 \x0313pink\x03, plain '
+    return (chunk * (length // len(chunk) + 1))[:length]
+
 
 class FormattingTestCase(unittest.TestCase):
     """Tests our formatting."""
@@ -14,6 +23,29 @@ class FormattingTestCase(unittest.TestCase):
         self.assertTrue(formatting.escape, msg=errmsg.format('escape'))
         self.assertTrue(formatting.unescape, msg=errmsg.format('unescape'))
 
+    def test_templates(self):
+        template = formatting.Template('$bHi$r {nick}, welcome to $c[red]{channel}$r {{:}}')
+
+        self.assertEqual(template.fields, ['nick', 'channel'])
+        self.assertEqual(template.render(nick='dan$b', channel='#chan'),
+                         '\x02Hi\x0f dan$b, welcome to \x0304#chan\x0f {:}')
+
+        # colours before a slot are padded so values starting with digits don't change them
+        self.assertEqual(template.render(nick='dan', channel=5),
+                         '\x02Hi\x0f dan, welcome to \x03045\x0f {:}')
+
+        self.assertEqual(formatting.Template('$c[red,blue]{n}').render(n=1), '\x034,021')
+        self.assertEqual(formatting.Template('$c[red]1{x}').render(x=2), '\x030412')
+        self.assertEqual(formatting.Template('${x}!', {'x': 'X'}).render(), 'X!')
+
+        with self.assertRaises(KeyError):
+            template.render(nick='dan')
+
+    def test_cached_unescape(self):
+        self.assertEqual(formatting.cached_unescape('$bcool$r'), '\x02cool\x0f')
+        self.assertIs(formatting.cached_unescape('$bcool$r'),
+                      formatting.cached_unescape('$bcool$r'))
+
     def test_removing_formatting(self):
         self.assertEqual(formatting.remove_formatting_codes('Lol \x03cool \x032tests\x0f!', irc=True),
                          'Lol cool tests!')
@@ -24,6 +56,42 @@ class FormattingTestCase(unittest.TestCase):
         self.assertEqual(formatting.remove_formatting_codes('Lol co${yolo}ol ${$}tests!$'),
                          'Lol cool $tests!')
 
+    def test_strip_stream(self):
+        raw = 'Lol \x03cool \x0312tests\x0f!\r\n\x02Straße\x02\n\x034,2last'
+
+        stripped = ['Lol cool tests!', 'Straße', 'last']
+        self.assertEqual(list(formatting.strip_formatting_stream(raw.splitlines(True))),
+                         stripped)
+        self.assertEqual(list(formatting.strip_formatting_stream(
+            line.encode() for line in raw.splitlines(True))), stripped)
+
+        # lines and codes split across chunks still come out whole
+        for chunk_size in (1, 5, 1024):
+            source = io.BytesIO(raw.encode())
+            self.assertEqual(list(formatting.strip_formatting_stream(source,
+                                                                     chunk_size=chunk_size)),
+                             stripped)
+
+    def test_spans(self):
+        spans = formatting.parse_spans('Lol \x02\x034,2cool\x03 <tests>\x0f!')
+
+        self.assertEqual(spans, [
+            formatting.Span('Lol ', False, False, False, None, None),
+            formatting.Span('cool', True, False, False, 4, 2),
+            formatting.Span(' <tests>', True, False, False, None, None),
+            formatting.Span('!', False, False, False, None, None),
+        ])
+        self.assertEqual(formatting.parse_spans('Lol $b$c[red,blue]cool$c <tests>$r!',
+                                                escaped=True), spans)
+
+        self.assertEqual(formatting.spans_to_text(spans), 'Lol cool <tests>!')
+        self.assertEqual(formatting.spans_to_ansi(spans),
+                         '\x1b[0mLol \x1b[0;1;91;44mcool\x1b[0;1m <tests>\x1b[0m!\x1b[0m')
+        self.assertEqual(formatting.spans_to_html(spans),
+                         'Lol <span style="font-weight: bold; color: #ff0000; '
+                         'background-color: #00007f">cool</span>'
+                         '<span style="font-weight: bold"> &lt;tests&gt;</span>!')
+
     def test_colour_codes(self):
         self.assertEqual(formatting._ctos(5), 'brown')
         self.assertEqual(formatting._ctos(452), 'unknown: 452')
@@ -88,3 +156,76 @@ class FormattingTestCase(unittest.TestCase):
         }
         self.assertEqual(formatting.unescape('abcd=${custom}=', extra_format_dict=extra_dict),
                          'abcd=-=')
+
+        # neither our dict nor the default one get changed
+        self.assertEqual(list(extra_dict), ['custom'])
+        self.assertEqual(formatting.unescape.__defaults__, ({},))
+
+        # colours are padded when digits follow them, so the digits aren't read as colours
+        self.assertEqual(formatting.unescape('Lol $c[red]5 $c[nope]$bcool'),
+                         'Lol \x03045 \x03[nope]\x02cool')
+        self.assertEqual(formatting.unescape('$c[red,blue]1 $c[red] 1'),
+                         '\x034,021 \x034 1')
+
+
+@run_benchmarks
+class FormattingBenchmarkTestCase(unittest.TestCase):
+    """Benchmarks escaping and unescaping long, formatting-heavy lines."""
+
+    def test_escape(self):
+        line = colourful_line()
+
+        def escape():
+            for i in range(1000):
+                formatting.escape(line)
+
+        report('escaped 512-byte lines', 1000 / timed(escape), 'lines/s')
+
+    def test_strip(self):
+        line = colourful_line()
+
+        def strip():
+            for i in range(1000):
+                formatting.remove_formatting_codes(line, irc=True)
+
+        report('stripped 512-byte lines', 1000 / timed(strip), 'lines/s')
+
+    def test_strip_stream(self):
+        log = ''.join(colourful_line(length) + '\r\n'
+                      for length in range(100, 500)).encode() * 40
+        megabytes = len(log) / 1024 / 1024
+
+        def strip_file():
+            for line in formatting.strip_formatting_stream(io.BytesIO(log)):
+                pass
+
+        lines = log.splitlines(True)
+
+        def strip_lines():
+            for line in formatting.strip_formatting_stream(lines):
+                pass
+
+        report('stripped log file', megabytes / timed(strip_file), 'MB/s')
+        report('stripped log lines', megabytes / timed(strip_lines), 'MB/s')
+
+    def test_unescape(self):
+        line = formatting.escape(colourful_line())
+
+        def unescape():
+            for i in range(1000):
+                formatting.unescape(line)
+
+        report('unescaped 512-byte lines', 1000 / timed(unescape), 'lines/s')
+
+    def test_linear_time(self):
+        # a line 64 times as long shouldn't take much more than 64 times as long
+        for function, escaped in ((formatting.escape, False), (formatting.unescape, True)):
+            short_line = colourful_line(512)
+            long_line = colourful_line(512 * 64)
+            if escaped:
+                short_line = formatting.escape(short_line)
+                long_line = formatting.escape(long_line)
+
+            short_taken = timed(lambda: [function(short_line) for i in range(128)])
+            long_taken = timed(lambda: [function(long_line) for i in range(2)])
+            self.assertLess(long_taken, short_taken * 2)
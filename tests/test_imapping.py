@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import unittest
+
+from girc.client import ServerConnection
+from girc.imapping import IString
+
+
+class IMappingTestCase(unittest.TestCase):
+    """Tests our casemapped objects."""
+
+    def setUp(self):
+        self.server = ServerConnection(name='test')
+
+    def test_shared_casemap(self):
+        s = self.server
+        nick = s.istring('Dan[]')
+        nicks = s.idict()
+
+        self.assertNotEqual(nick, 'dan{}')
+
+        s.set_casemapping('rfc1459')
+
+        # objects created before CASEMAPPING follow the server's standard
+        self.assertEqual(nick, 'dan{}')
+        self.assertEqual(nick.lower(), 'dan{}')
+        self.assertEqual(nick.upper(), 'DAN[]')
+
+        nicks['Dan[]'] = 1
+        self.assertEqual(nicks['DAN{}'], 1)
+
+    def test_rekeying(self):
+        s = self.server
+        nicks = s.idict({'Dan[]': 1})
+        channels = s.ilist(['#Chan[]'])
+
+        s.set_casemapping('rfc1459')
+
+        # existing keys and values are re-folded when CASEMAPPING arrives
+        self.assertEqual(nicks['dan{}'], 1)
+        self.assertEqual(list(nicks), ['dan{}'])
+        self.assertIn('#CHAN{}', channels)
+
+        # any iterable is folded
+        channels.extend(name for name in ['#Other[]'])
+        self.assertIn('#other{}', channels)
+
+        # and once it has, we stop keeping track of them
+        self.assertIsNone(s.casemap._containers)
+
+    def test_registry_is_weak(self):
+        s = self.server
+        registered = len(s.casemap._containers)
+
+        for i in range(100):
+            s.idict({'dan': i})
+        self.assertEqual(len(s.casemap._containers), registered)
+
+    def test_string_methods(self):
+        s = self.server
+        s.set_casemapping('rfc1459')
+        nick = s.istring(' Dan[] ')
+
+        # methods that return strings give back casemapped strings
+        stripped = nick.strip()
+        self.assertIsInstance(stripped, IString)
+        self.assertEqual(stripped, 'dan{}')
+        self.assertEqual(hash(stripped), hash(s.istring('DAN{}')))
+
+        self.assertEqual(nick.split(), ['Dan[]'])
+        self.assertIn('N{', nick)
+        self.assertLess(s.istring('ALICE'), 'bob')
+        self.assertNotEqual(stripped, None)
+
+    def test_fold_table(self):
+        s = self.server
+        s.casemap.max_folds = 2
+        nicks = s.idict()
+
+        for nick in ('Dan', 'Jess', 'Dan[]'):
+            nicks[nick] = nick
+        self.assertEqual(list(s.casemap._folds), ['Jess', 'Dan[]'])
+        self.assertEqual(nicks['dan[]'], 'Dan[]')
+
+        # changing the standard forgets every name we've folded
+        s.set_casemapping('rfc1459')
+        self.assertNotIn('Dan[]', s.casemap._folds)
+        self.assertEqual(s.istring('Dan[]'), 'dan{}')
+
+    def test_rfc3454(self):
+        s = self.server
+        s.set_casemapping('rfc3454')
+        nicks = s.idict()
+
+        nicks['Dan[]'] = 1
+        nicks['NÏCK'] = 2
+        self.assertEqual(nicks['dan[]'], 1)
+        self.assertNotIn('dan{}', nicks)
+        self.assertEqual(nicks['nïck'], 2)
+        self.assertEqual(s.istring('Straße'), 'STRASSE')
+
+    def test_interning(self):
+        s = self.server
+
+        host = s.istring('example.com', intern=True)
+        self.assertIs(s.istring('example.com', intern=True), host)
+        self.assertIsNot(s.istring('Example.com', intern=True), host)
+        self.assertIsNot(s.istring('example.com'), host)
+
+        # strings are slotted, so caching their folded key doesn't cost a dict each
+        self.assertFalse(hasattr(host, '__dict__'))
+
+    def test_user_records(self):
+        s = self.server
+        s.info.create_user('dan!~lol@localhost')
+        s.info.create_user('jess!~lol@localhost')
+
+        dan = s.info.users['dan']
+        jess = s.info.users['jess']
+
+        self.assertIs(dan.host, jess.host)
+        self.assertEqual(dan.nickmask, 'dan!~lol@localhost')
+        self.assertFalse(hasattr(dan, '__dict__'))
+
+        # masks are remembered until the user changes
+        self.assertIs(dan.nickmask, dan.nickmask)
+
+        # seeing them again with the same mask doesn't count as a change
+        nickmask = dan.nickmask
+        nick = dan.nick
+        s.info.create_user('dan!~lol@localhost')
+        self.assertIs(dan.nickmask, nickmask)
+        self.assertIs(dan.nick, nick)
+
+        dan.host = 'example.com'
+        self.assertEqual(dan.nickmask, 'dan!~lol@example.com')
+        self.assertEqual(dan.userhost, '~lol@example.com')
+        dan.nick = 'Daniel'
+        self.assertEqual(dan.nickmask, 'Daniel!~lol@example.com')
+
+        # changing case counts, even though the nick's still equal
+        dan.nick = 'DANIEL'
+        self.assertEqual(str(dan.nick), 'DANIEL')
+        self.assertEqual(dan.nickmask, 'DANIEL!~lol@example.com')
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import asyncio
+import unittest
+
+from girc.client import ServerConnection
+from girc.types import Channel, User
+
+loop = asyncio.get_event_loop()
+
+
+class FakeTransport:
+    """Collects lines we send, instead of sending them to a server."""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(data.decode('utf8'))
+
+    def get_extra_info(self, name):
+        if name == 'peername':
+            return ('127.0.0.1', 6667)
+
+
+def create_server(nick='girc', **kwargs):
+    server = ServerConnection(name='test', **kwargs)
+    server.set_user_info(nick)
+    server.transport = FakeTransport()
+    server.connected = True
+    server.data_received(':irc.example.com 001 {} :Welcome to IRC\r\n'.format(nick).encode())
+    return server
+
+
+class InfoTestCase(unittest.TestCase):
+    """Tests our state tracking."""
+
+    def test_membership(self):
+        s = create_server()
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n'
+                        b':dan!~lol@localhost JOIN #chan\r\n')
+
+        dan = s.info.users['dan']
+        chan = s.info.channels['#chan']
+
+        self.assertEqual(list(dan.channel_names), ['#chan'])
+        self.assertIn('dan', chan.users)
+
+        s.data_received(b':dan!~lol@localhost PART #chan\r\n')
+        self.assertEqual(list(dan.channel_names), [])
+        self.assertNotIn('dan', chan.users)
+
+        # when we part, we stop sharing the channel with everyone in it
+        s.data_received(b':jess!~lol@localhost JOIN #chan\r\n'
+                        b':girc!~g@localhost PART #chan\r\n')
+        self.assertEqual(list(s.info.users['jess'].channel_names), [])
+        self.assertFalse(chan.joined)
+
+    def test_privileges(self):
+        s = create_server()
+        s.features.ingest('PREFIX=(qaohv)~&@%+')
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n'
+                        b':irc.example.com 353 girc = #chan :@girc dan &%jess\r\n'
+                        b':dan!~lol@localhost MODE #chan +vo-o+h dan dan girc girc\r\n')
+
+        chan = s.info.channels['#chan']
+        self.assertEqual(chan.prefixes['dan'], '@+')
+        self.assertEqual(chan.prefixes['girc'], '%')
+        self.assertIs(chan.prefixes['dan'], s.features.prefix_string(s.features.prefix_mask('@+')))
+
+        self.assertTrue(chan.has_privs('dan'))
+        self.assertTrue(chan.has_privs(s.info.users['jess'], 'o'))
+        self.assertFalse(chan.has_privs('girc'))
+        self.assertTrue(chan.has_privs('girc', 'h'))
+        self.assertTrue(chan.has_privs('girc', 'oh'))
+        self.assertFalse(chan.has_privs('dan', 'a'))
+        self.assertFalse(chan.has_privs('nobody', 'v'))
+
+    def test_feature_views(self):
+        s = create_server()
+        f = s.features
+        f.ingest('PREFIX=(qaohv)~&@%+', 'CHANMODES=beI,k,l,imnpst', 'NICKLEN=30', 'CHANTYPES=#&')
+
+        self.assertEqual(f.prefix_chars, '~&@%+')
+        self.assertEqual(f.prefix_modes['%'], 'h')
+        self.assertEqual(f.list_modes, 'beI')
+        self.assertEqual(f.chantypes, frozenset('#&'))
+        self.assertEqual(f.nicklen, 30)
+        self.assertEqual(f.linelen, 512)
+
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n'
+                        b':irc.example.com 353 girc = #chan :@girc ~&dan\r\n')
+        self.assertEqual(s.info.channels['#chan'].prefixes['dan'], '~&')
+        self.assertEqual(s.info.channels['#chan'].modes, {'b': [], 'e': [], 'I': []})
+
+        f.ingest('-NICKLEN', '-CHANTYPES')
+        self.assertIsNone(f.nicklen)
+        self.assertEqual(f.chantypes, frozenset('#'))
+
+    def test_chantypes(self):
+        s = create_server()
+        self.assertTrue(s.is_channel('#chan'))
+        self.assertFalse(s.is_channel('&chan'))
+        self.assertTrue(s.is_server('irc.example.com'))
+        self.assertTrue(s.is_nick('Dan'))
+
+        s.features.ingest('CHANTYPES=#&')
+        self.assertTrue(s.is_channel('&chan'))
+
+        events = []
+        s.register_event('in', 'all', events.append)
+        s.data_received(b':dan!~lol@localhost PRIVMSG &chan :hi there\r\n')
+        self.assertEqual(events[0]['verb'], 'pubmsg')
+
+    def test_user_eviction(self):
+        s = create_server()
+        s.info.max_unshared_users = 2
+
+        evicted = []
+        s.register_event('girc', 'evict user', lambda event: evicted.append(event['user'].nick))
+
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n'
+                        b':dan!~lol@localhost JOIN #chan\r\n')
+
+        for nick in ('a', 'b', 'c', 'd'):
+            s.info.create_user('{}!~lol@localhost'.format(nick))
+
+        # users we share channels with are never evicted
+        self.assertEqual(evicted, ['a', 'b'])
+        self.assertIn('dan', s.info.users)
+        self.assertNotIn('a', s.info.users)
+        self.assertIn('d', s.info.users)
+
+        # seeing a user again makes them the most recently seen
+        s.info.create_user('c')
+        s.info.create_user('e')
+        self.assertEqual(evicted, ['a', 'b', 'd'])
+
+        # once we stop sharing channels, users can be evicted again
+        s.data_received(b':dan!~lol@localhost PART #chan\r\n')
+        s.info.create_user('f')
+        self.assertEqual(evicted, ['a', 'b', 'd', 'c', 'e'])
+
+    def test_user_expiry(self):
+        s = create_server()
+        s.info.unshared_user_ttl = 60
+
+        s.info.create_user('dan')
+        s.info.create_user('jess')
+        s.info._unshared_users[s.info.users['dan']] -= 120
+
+        s.info.evict_users()
+        self.assertNotIn('dan', s.info.users)
+        self.assertIn('jess', s.info.users)
+
+    def test_quiet_expiry(self):
+        s = create_server()
+        s.info.unshared_user_ttl = 60
+        s.info.evict_interval = 0.01
+        s.data_received(b':irc.example.com 376 girc :End of /MOTD command.\r\n')
+
+        s.info.create_user('dan')
+        s.info.create_user('jess')
+        s.info._unshared_users[s.info.users['dan']] -= 120
+
+        # stale users are removed even if we don't hear anything else
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertNotIn('dan', s.info.users)
+        self.assertIn('jess', s.info.users)
+
+        # and we stop looking once we've disconnected
+        s.connected = False
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertIsNone(s.info._evict_timer)
+
+    def test_minimal_tracking(self):
+        s = create_server(tracking='minimal')
+
+        events = []
+        s.register_event('in', 'all', events.append)
+
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n'
+                        b':dan!~lol@localhost JOIN #chan\r\n'
+                        b':dan!~lol@localhost PRIVMSG #chan :hi there\r\n'
+                        b':dan!~lol@localhost PRIVMSG #other :hi there\r\n'
+                        b':dan!~lol@localhost PRIVMSG girc :hello\r\n')
+
+        chan = s.info.channels['#chan']
+        self.assertTrue(chan.joined)
+        self.assertIn('dan', chan.prefixes)
+        self.assertEqual(len(s.info.users), 0)
+
+        pubmsg = events[2]
+        self.assertEqual(pubmsg['source'], 'dan!~lol@localhost')
+        self.assertIs(pubmsg['channel'], chan)
+        self.assertIs(pubmsg['from_to'], chan)
+
+        # we only track channels we're in
+        self.assertEqual(events[3]['channel'], '#other')
+        self.assertNotIn('#other', s.info.channels)
+
+        self.assertEqual(events[4]['from_to'], 'dan')
+
+        # members are given as nicks, since we aren't tracking users
+        s.data_received(b':irc.example.com 353 girc = #chan :@girc dan jess\r\n')
+        self.assertEqual(chan.users, {'girc': 'girc', 'dan': 'dan', 'jess': 'jess'})
+
+        user = User(s, 'dan!~lol@localhost')
+        user.channels = ['#chan', '#other']
+        self.assertEqual(user.channels, [chan, '#other'])
+
+        s.data_received(b':girc!~g@localhost PART #chan\r\n')
+        self.assertFalse(chan.joined)
+        self.assertNotIn('#chan', s.info.channels)
+
+    def test_no_tracking(self):
+        s = create_server(tracking='none')
+
+        events = []
+        s.register_event('in', 'all', events.append)
+
+        s.data_received(b':girc!~g@localhost JOIN #a,#b\r\n'
+                        b':dan!~lol@localhost PRIVMSG #a :hi there\r\n'
+                        b':irc.example.com 353 girc = #a :girc @dan\r\n')
+
+        self.assertEqual(len(s.info.channels), 0)
+        self.assertEqual(len(s.info.users), 0)
+
+        self.assertEqual(events[0]['channels'], ['#a', '#b'])
+        self.assertEqual(events[1]['channel'], '#a')
+        self.assertFalse(isinstance(events[1]['from_to'], Channel))
+        self.assertEqual(events[2]['users'], ['girc', 'dan'])
+        self.assertEqual(events[2]['prefixes'], {'girc': '', 'dan': '@'})
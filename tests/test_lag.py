@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import unittest
+
+from girc.lag import percentile
+
+from .test_info import create_server
+
+
+class LagTestCase(unittest.TestCase):
+    """Tests our lag measurements."""
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 51)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile(samples, 100), 100)
+        self.assertEqual(percentile([3, 1, 2], 0), 1)
+        self.assertIsNone(percentile([], 50))
+
+    def test_round_trip(self):
+        s = create_server()
+        events = []
+        s.register_event('girc', 'lag', events.append)
+
+        s.lag.ping()
+        line = s.transport.lines[-1]
+        self.assertTrue(line.startswith('PING girc-lag-'))
+        self.assertIsNotNone(s.lag.current)
+
+        # we don't answer our own PINGs
+        self.assertEqual(len(s.transport.lines), 1)
+
+        token = line.split()[1]
+        s.data_received(':irc.example.com PONG irc.example.com :{}\r\n'.format(token).encode())
+        s.data_received(b':irc.example.com PONG irc.example.com :someone-elses\r\n')
+
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['rtt'], s.lag.rtt)
+        self.assertEqual(s.lag.current, s.lag.rtt)
+        self.assertEqual(s.lag.stats()['rtt'][50], s.lag.rtt)
+
+    def test_processing(self):
+        s = create_server()
+        count = len(s.lag.processing)
+
+        s.data_received(b':irc.example.com PING :token\r\n')
+        self.assertEqual(s.transport.lines[-1], 'PONG token\r\n')
+        self.assertEqual(len(s.lag.processing), count + 1)
+        self.assertGreater(s.lag.stats()['processing'][99], 0)
+
+        # partial lines don't count until they're handled
+        s.data_received(b':irc.example.com PING')
+        self.assertEqual(len(s.lag.processing), count + 1)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import time
+import unittest
+
+from girc.ircreactor.events import EventObject
+from girc.profiling import DispatchProfiler
+
+from .test_info import create_server
+
+
+def slow_handler(event):
+    time.sleep(0.002)
+
+
+def broken_handler(event):
+    raise ValueError('oops')
+
+
+class ProfilingTestCase(unittest.TestCase):
+    """Tests profiling our event handlers."""
+
+    def test_snapshot(self):
+        s = create_server()
+        profiler = s.enable_profiling()
+
+        s.register_event('in', 'pubmsg', slow_handler)
+        s.data_received(b':dan!~lol@localhost PRIVMSG #chan :hi\r\n'
+                        b':dan!~lol@localhost PRIVMSG #chan :hi\r\n')
+
+        stats = profiler.snapshot()
+        self.assertEqual(stats[0]['handler'], 'tests.test_profiling.slow_handler')
+        self.assertEqual(stats[0]['server'], 'test')
+        self.assertEqual(stats[0]['direction'], 'in')
+        self.assertEqual(stats[0]['verb'], 'pubmsg')
+        self.assertEqual(stats[0]['calls'], 2)
+        self.assertGreaterEqual(stats[0]['max'], 0.002)
+        self.assertGreaterEqual(stats[0]['total'], stats[0]['max'])
+
+        profiler.reset()
+        self.assertEqual(profiler.snapshot(), [])
+
+    def test_errors(self):
+        s = create_server()
+        profiler = s.enable_profiling()
+        s.register_event('in', 'pubmsg', broken_handler)
+
+        with self.assertRaises(ValueError):
+            s.data_received(b':dan!~lol@localhost PRIVMSG #chan :hi\r\n')
+
+        stats = [entry for entry in profiler.snapshot() if entry['verb'] == 'pubmsg']
+        self.assertEqual(stats[0]['errors'], 1)
+
+    def test_slow_handlers(self):
+        s = create_server()
+        s.enable_profiling(DispatchProfiler(budget=0.001))
+
+        warnings = []
+        s.register_event('girc', 'slow handler', warnings.append)
+        s.register_event('girc', 'slow handler', slow_handler)
+        s.register_event('in', 'pubmsg', slow_handler)
+        s.data_received(b':dan!~lol@localhost PRIVMSG #chan :hi\r\n')
+
+        self.assertEqual(len(warnings), 1)
+        self.assertIs(warnings[0]['handler'], slow_handler)
+        self.assertGreater(warnings[0]['seconds'], 0.001)
+
+    def test_disabled(self):
+        s = create_server()
+        s.enable_profiling()
+        s.disable_profiling()
+
+        # dispatching goes straight back to the unprofiled method
+        for event_object in s._events_in.events.values():
+            self.assertEqual(event_object.dispatch.__func__, EventObject.dispatch)
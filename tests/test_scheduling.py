@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Written by Daniel Oaks <daniel@danieloaks.net>
+# Released under the ISC license
+import asyncio
+import unittest
+
+from girc.scheduling import ConnectScheduler, ReconnectScheduler
+
+from .test_info import FakeTransport, create_server
+
+loop = asyncio.get_event_loop()
+
+
+def run_briefly(seconds=0.01):
+    loop.run_until_complete(asyncio.sleep(seconds))
+
+
+def reconnecting_server(reconnector=None, connector=None, name='test'):
+    """Return a server that 'connects' to a fake transport."""
+    s = create_server()
+    s.name = name
+    s.reconnector = reconnector or ReconnectScheduler()
+    s.connector = connector or ConnectScheduler(host_interval=0)
+    s.connect_info['connection'] = {'auto_reconnect': True, 'args': (), 'kwargs': {}}
+
+    s.opened = 0
+
+    def open_connection():
+        s.opened += 1
+        s.connection_made(FakeTransport())
+    s._open_connection = open_connection
+
+    return s
+
+
+class ReconnectTestCase(unittest.TestCase):
+    """Tests reconnecting dropped connections."""
+
+    def test_backoff(self):
+        reconnector = ReconnectScheduler(min_delay=1, max_delay=10, jitter=0.5)
+
+        for attempt, longest in enumerate((1, 2, 4, 8, 10, 10)):
+            for i in range(20):
+                delay = reconnector.delay(attempt)
+                self.assertLessEqual(delay, longest)
+                self.assertGreaterEqual(delay, longest / 2)
+
+    def test_concurrency_cap(self):
+        reconnector = ReconnectScheduler(max_concurrent=2, min_delay=0, jitter=0)
+        servers = [reconnecting_server(reconnector) for i in range(5)]
+
+        for s in servers:
+            s.connection_lost(None)
+        run_briefly()
+        self.assertEqual([s.opened for s in servers], [1, 1, 0, 0, 0])
+
+        # once a server is ready, the next one gets its turn
+        servers[0].data_received(b':irc.example.com 376 girc :End of MOTD\r\n')
+        self.assertEqual([s.opened for s in servers], [1, 1, 1, 0, 0])
+        self.assertNotIn(servers[0], reconnector.attempts)
+
+        # and servers that drop again back off for longer
+        servers[1].connection_lost(None)
+        self.assertEqual(reconnector.attempts[servers[1]], 2)
+        self.assertEqual([s.opened for s in servers], [1, 1, 1, 1, 0])
+
+    def test_quit(self):
+        reconnector = ReconnectScheduler(min_delay=0)
+        s = reconnecting_server(reconnector)
+
+        s.connection_lost(None)
+        self.assertIn(s, reconnector.attempts)
+
+        # quitting while we wait to reconnect means we don't
+        s.quit()
+        run_briefly()
+        self.assertEqual(s.opened, 0)
+        self.assertNotIn(s, reconnector.attempts)
+
+    def test_resync(self):
+        reconnector = ReconnectScheduler(min_delay=0)
+        s = reconnecting_server(reconnector)
+        s.features.ingest('CHANMODES=b,k,l,imnst')
+        s.connect_info['channels'] = ['#Chan']
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n'
+                        b':irc.example.com 353 girc = #chan :girc @dan jess\r\n'
+                        b':irc.example.com 366 girc #chan :End of /NAMES list\r\n'
+                        b':girc!~g@localhost JOIN #keyed\r\n'
+                        b':dan!~lol@localhost MODE #keyed +k secret\r\n'
+                        b':girc!~g@localhost JOIN #banned\r\n')
+        dan = s.info.users['dan']
+
+        s.connection_lost(None)
+        run_briefly()
+        self.assertEqual(s.opened, 1)
+        self.assertFalse(s.info.channels['#chan'].joined)
+
+        s.data_received(b':irc.example.com CAP * LS :\r\n'
+                        b':irc.example.com 001 girc :Welcome to IRC\r\n'
+                        b':irc.example.com 376 girc :End of MOTD\r\n')
+        # channels from our connect info are only joined once, whatever their case
+        self.assertEqual(s.transport.lines[-1], 'JOIN #keyed,#Chan,#banned secret\r\n')
+
+        # we only change what's changed while we were away
+        s.data_received(b':girc!~g@localhost JOIN #chan\r\n'
+                        b':irc.example.com 353 girc = #chan :girc dan\r\n'
+                        b':irc.example.com 366 girc #chan :End of /NAMES list\r\n'
+                        b':irc.example.com 474 girc #banned :Cannot join channel (+b)\r\n')
+
+        chan = s.info.channels['#chan']
+        self.assertTrue(chan.joined)
+        self.assertIs(s.info.users['dan'], dan)
+        self.assertEqual(chan.prefixes['dan'], '')
+        self.assertNotIn('jess', chan.users)
+        self.assertNotIn('#banned', s.info.channels)
+        self.assertIn('#keyed', s.info.channels)
+
+
+class ConnectTestCase(unittest.TestCase):
+    """Tests staggering new connections."""
+
+    def test_priority(self):
+        connector = ConnectScheduler(max_concurrent=1, host_interval=0)
+        servers = [reconnecting_server(connector=connector, name=str(i)) for i in range(5)]
+
+        for s, priority in zip(servers, (10, 5, 1, 3, 1)):
+            connector.request(s, host=s.name, priority=priority)
+
+        def opened():
+            return [i for i, s in enumerate(servers) if s.opened]
+
+        self.assertEqual(opened(), [0])
+        connector.ready(servers[0])
+        self.assertEqual(opened(), [0, 2])
+
+        # servers that fail to connect give up their turn as well
+        connector.forget(servers[2])
+        self.assertEqual(opened(), [0, 2, 4])
+        connector.ready(servers[4])
+        self.assertEqual(opened(), [0, 2, 3, 4])
+
+    def test_host_interval(self):
+        connector = ConnectScheduler(host_interval=0.05)
+        a, b, c = [reconnecting_server(connector=connector, name=name) for name in 'abc']
+
+        connector.request(a, host='irc.example.com')
+        connector.request(b, host='irc.example.com')
+        connector.request(c, host='irc.example.org')
+        self.assertEqual([s.opened for s in (a, b, c)], [1, 0, 1])
+
+        run_briefly(0.1)
+        self.assertEqual(b.opened, 1)
+
+    def test_time_to_ready(self):
+        s = reconnecting_server()
+        events = []
+        s.register_event('girc', 'ready', events.append)
+
+        s.connector.request(s)
+        s.data_received(b':irc.example.com 376 girc :End of MOTD\r\n')
+
+        self.assertGreaterEqual(events[0]['time_to_ready'], 0)
+        self.assertEqual(s.connector.ready_times['test'], events[0]['time_to_ready'])
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # Written by Daniel Oaks <daniel@danieloaks.net>
 # Released under the ISC license
+import time
 import unittest
 
 from girc import utils
@@ -22,6 +23,11 @@ class UtilsTestCase(unittest.TestCase):
         self.assertEqual(nm.userhost, '~lol@localhost')
         self.assertEqual(nm.nickmask, 'dan!~lol@localhost')
 
+        # parses are shared, but masks are still independent
+        nm.nick = 'jess'
+        self.assertEqual(utils.NickMask('dan!~lol@localhost').nick, 'dan')
+        self.assertFalse(hasattr(nm, '__dict__'))
+
         nm = utils.NickMask('dan!~lol')
 
         self.assertEqual(nm.nick, 'dan')
@@ -128,3 +134,60 @@ class UtilsTestCase(unittest.TestCase):
             ['+', 'i', None],
             ['+', 'p', None],
         ])
+
+        # mode tables are compiled once and reused
+        table = utils.compile_mode_table(modes, 'vo')
+        self.assertEqual(table['o'], (True, True, False, 1))
+        self.assertEqual(table['b'], (True, True, True, None))
+        self.assertEqual(table['l'], (True, False, False, None))
+
+        self.assertEqual(pm(['+o-lo+v', 'dan', 'jess'], table=table), [
+            ['+', 'o', 'dan'],
+            ['-', 'l', None],
+            ['-', 'o', 'jess'],
+            ['+', 'v', None],
+        ])
+
+    def test_parse_server_time(self):
+        pst = utils.parse_server_time
+
+        value = '2011-10-19T16:40:51.620Z'
+        self.assertEqual(pst(value), time.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ'))
+        self.assertEqual(pst('2011-10-19T16:40:51Z'), pst(value))
+
+        self.assertIsNone(pst(''))
+        self.assertIsNone(pst('2011-13-19T16:40:51.620Z'))
+        self.assertIsNone(pst('2011-10-19T16:40:51.62OZ'))
+        self.assertIsNone(pst('2011-10-19 16:40:51.620Z'))
+
+    def test_name_classifier(self):
+        classifier = utils.NameClassifier('#&')
+        classify = classifier.classify
+
+        self.assertEqual(classify('#chan'), 'channel')
+        self.assertEqual(classify('&local'), 'channel')
+        self.assertEqual(classify('irc.example.com'), 'server')
+        self.assertEqual(classify('Dan[]'), 'nick')
+        self.assertEqual(classify('dan!~lol@host.example.com'), None)
+        self.assertEqual(classify(''), None)
+
+        # recently-seen names are remembered, up to a limit
+        classifier = utils.NameClassifier(max_names=2)
+        for name in ('#chan', 'dan', 'jess', 'dan'):
+            classifier.classify(name)
+        self.assertEqual(list(classifier._kinds), ['dan', 'jess'])
+
+    def test_batch_joins(self):
+        bj = utils.batch_joins
+
+        self.assertEqual(bj([('#a', None), ('#b', 'key'), ('#c', None)]),
+                         [['#b,#a,#c', 'key']])
+        self.assertEqual(bj([]), [])
+
+        # lines are kept under the given length
+        channels = [('#channel{}'.format(i), None) for i in range(100)]
+        batches = bj(channels, max_length=100)
+        self.assertTrue(all(len('JOIN {}\r\n'.format(' '.join(params))) <= 100
+                            for params in batches))
+        self.assertEqual(','.join(params[0] for params in batches).split(','),
+                         [name for name, key in channels])